@@ -0,0 +1,58 @@
+"""
+Measure the memory figures used by utils.resources to size the workers and DataLoader batches.
+
+Prints the resident memory of the libraries of an API worker, of the loaded model, and the
+peak memory added per form when batches of growing sizes go through the model. Use them for
+WORKER_MEMORY_MB (libraries and peak batch memory of a worker, the model weights being shared)
+and FORM_MEMORY_MB (peak memory per form).
+
+Usage (from the repository root, with the MLFLOW_* variables of the served model):
+    PYTHONPATH=src uv run python benchmarks/memory.py [batch_size ...]
+"""
+
+import os
+import resource
+import sys
+
+import api.main  # noqa: F401 (libraries imported by an API worker)
+from utils.inference import PredictParams, parity_forms, predict_batch
+from utils.load_model import load_model
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_forms(nb_forms: int) -> list:
+    # Real and synthetic forms, long descriptions included
+    forms = parity_forms()
+    return [forms[idx % len(forms)] for idx in range(nb_forms)]
+
+
+def main(sizes: list[int]):
+    libraries = rss_mb()
+    model = load_model()
+    model_mb = rss_mb() - libraries
+    predict_batch(model, make_forms(1), PredictParams(5, 0.01))
+    print(f"libraries: {libraries:.0f} MB, model: {model_mb:.0f} MB")
+
+    # Peak memory only grows: batches run by increasing size, and the memory per form is the
+    # peak growth between two sizes
+    print(f"{'nb_forms':>10} {'peak RSS (MB)':>14} {'MB/form':>8}")
+    previous_size, previous_peak = 1, peak_rss_mb()
+    for nb_forms in sorted(sizes):
+        predict_batch(model, make_forms(nb_forms), PredictParams(5, 0.01))
+        peak = peak_rss_mb()
+        per_form = (peak - previous_peak) / (nb_forms - previous_size)
+        print(f"{nb_forms:>10} {peak:>14.0f} {per_form:>8.3f}")
+        previous_size, previous_peak = nb_forms, peak
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [16, 64, 256, 1024])
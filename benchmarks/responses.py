@@ -0,0 +1,66 @@
+"""
+Benchmark of the /predict response construction: per-row OutputResponse vs fast path.
+
+Usage (from the repository root):
+    PYTHONPATH=src uv run python benchmarks/responses.py [nb_forms ...]
+"""
+
+import json
+import sys
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+from timing import best_times
+
+from api.models.responses import OutputResponse, build_responses
+
+MODEL_ID = "benchmark-model"
+response_adapter = TypeAdapter(List[OutputResponse])
+
+
+def per_row_path(outputs: list[dict]) -> bytes:
+    # Response construction as done before the fast path: one OutputResponse per row,
+    # then FastAPI validation against the response_model and the standard JSON encoding
+    responses = [OutputResponse({**out, "MLversion": MODEL_ID}) for out in outputs]
+    validated = response_adapter.validate_python(responses)
+    return json.dumps(
+        jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def fast_path(outputs: list[dict]) -> bytes:
+    return to_json(build_responses(outputs, MODEL_ID))
+
+
+def make_outputs(nb_forms: int, nb_echos_max: int = 5) -> list[dict]:
+    return [
+        {
+            **{
+                str(rank): {
+                    "code": f"{rank:04d}Z",
+                    "probabilite": round(1 / (rank + 1), 2),
+                    "libelle": f"Libellé de la sous-classe {rank}",
+                }
+                for rank in range(1, nb_echos_max + 1)
+            },
+            "IC": 0.42,
+        }
+        for _ in range(nb_forms)
+    ]
+
+
+def main(sizes: list[int]):
+    print(f"{'nb_forms':>10} {'per-row (µs/form)':>19} {'fast (µs/form)':>16} {'speedup':>8}")
+    for nb_forms in sizes:
+        outputs = make_outputs(nb_forms)
+        assert json.loads(per_row_path(outputs)) == json.loads(fast_path(outputs))
+        repeat = max(5, min(1000, 100_000 // nb_forms))
+        slow, fast = best_times([per_row_path, fast_path], outputs, repeat)
+        slow, fast = slow / nb_forms * 1e6, fast / nb_forms * 1e6
+        print(f"{nb_forms:>10} {slow:>19.2f} {fast:>16.2f} {slow / fast:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1, 100, 10_000, 100_000])
@@ -0,0 +1,27 @@
+"""
+Timing helpers shared by the benchmarks.
+"""
+
+import gc
+import time
+
+
+def best_times(funcs: list, arg, repeat: int) -> list[float]:
+    """
+    Best duration (s) of each function called on `arg`, over `repeat` runs.
+
+    Runs are interleaved with the garbage collector disabled (as timeit does), so that
+    collections triggered by one function do not end up in the timings of the other ones.
+    """
+    timings = [[] for _ in funcs]
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for func, func_timings in zip(funcs, timings):
+                start = time.perf_counter()
+                func(arg)
+                func_timings.append(time.perf_counter() - start)
+            gc.collect()
+    finally:
+        gc.enable()
+    return [min(func_timings) for func_timings in timings]
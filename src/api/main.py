@@ -2,6 +2,7 @@
 Main file for the API.
 """
 
+import asyncio
 import logging
 import os
 from contextlib import asynccontextmanager
@@ -9,11 +10,30 @@ from typing import Annotated
 
 from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.security import HTTPBasicCredentials
 
-from api.routes import predict
-from utils.load_model import load_model
+from api.models.forms import SingleForm
+from api.models.responses import build_responses
+from api.routes import admin, health, jobs, predict
+from utils.batching import PredictionBatcher
+from utils.cache import PredictionCache
+from utils.inference import (
+    PredictParams,
+    predict_forms,
+    run_batch,
+    start_inference_pool,
+    warm_up,
+)
+from utils.jobs import STORAGE_BACKENDS, JobManager
+from utils.load_model import load_model, resolve_alias
 from utils.logging import configure_logging
+from utils.metrics import MODEL_INFO, PREDICTION_LOG_PENDING, QUEUE_DEPTH, MetricsMiddleware
+from utils.metrics import REGISTRY as METRICS
+from utils.prediction_log import create_prediction_logger
+from utils.profiling import ProfileStore, ProfilingMiddleware
+from utils.registry import ModelRegistry
+from utils.resources import configure_resources, set_torch_threads
 from utils.security import get_credentials
 
 
@@ -23,11 +43,107 @@ async def lifespan(app: FastAPI):
     logger = logging.getLogger(__name__)
     logger.info("🚀 Starting API lifespan")
 
-    app.state.model = load_model()
-    app.state.model_id = app.state.model.metadata.model_id
+    # Threads and batch sizes fitted to the CPU quota and memory limit of the container
+    configure_resources()
+    set_torch_threads()
+
+    app.state.prediction_cache = PredictionCache(
+        max_size=int(os.getenv("PREDICT_CACHE_SIZE", "10000")),
+        ttl_seconds=float(os.getenv("PREDICT_CACHE_TTL", "3600")),
+    )
+
+    # Model versions are loaded next to the current one and swapped once warmed up
+    app.state.registry = ModelRegistry(
+        load_model,
+        warm_up,
+        retention_seconds=float(os.getenv("MODEL_RETENTION_SECONDS", "3600")),
+        max_versions=int(os.getenv("MODEL_MAX_VERSIONS", "2")),
+        on_swap=lambda entry: app.state.prediction_cache.ensure_model(entry.model_id),
+    )
+    # A swap only reaches the process it runs in: api.serve disables it with several workers
+    app.state.hot_swap = os.getenv("MODEL_HOT_SWAP", "True") == "True"
+
+    # Inference runs in a dedicated, server-owned thread pool so that it never blocks
+    # the event loop; it is started once here and reused by every request
+    concurrency = int(os.getenv("INFERENCE_CONCURRENCY", "1"))
+    app.state.executor = start_inference_pool(concurrency)
+
+    app.state.batcher = PredictionBatcher(
+        run_batch,
+        max_batch_size=int(os.getenv("PREDICT_MAX_BATCH_SIZE", "64")),
+        max_wait_ms=float(os.getenv("PREDICT_MAX_WAIT_MS", "5")),
+        executor=app.state.executor,
+        max_concurrency=concurrency,
+        max_pending=int(os.getenv("PREDICT_MAX_PENDING", "256")),
+    )
+    app.state.batcher.start()
+
+    # Prediction events are sampled and written by a background thread, off the request path
+    app.state.prediction_log = create_prediction_logger()
+    if app.state.prediction_log is not None:
+        app.state.prediction_log.start()
+        PREDICTION_LOG_PENDING.collect = lambda: {(): app.state.prediction_log.stats()["pending"]}
+
+    async def predict_job_chunk(forms: list[dict], params: dict) -> list[dict]:
+        forms = [SingleForm.model_validate(form) for form in forms]
+        model = app.state.registry.get()
+        predictions = await predict_forms(app.state, forms, PredictParams(**params), model)
+        return build_responses(predictions.outputs, model.model_id)
+
+    storage = STORAGE_BACKENDS[os.getenv("JOBS_STORAGE_BACKEND", "local")](
+        os.getenv("JOBS_STORAGE_PATH", "/tmp/codif-ape-jobs")
+    )
+    app.state.jobs = JobManager(
+        storage,
+        predict_job_chunk,
+        chunk_size=int(os.getenv("JOBS_CHUNK_SIZE", "1024")),
+        runner=os.getenv("JOBS_RUNNER", "True") == "True",
+        poll_interval=float(os.getenv("JOBS_POLL_INTERVAL", "5")),
+        retention=float(os.getenv("JOBS_RETENTION", "604800")),
+    )
+
+    # The model is loaded and warmed up in the background: the API is live right away and
+    # only reports ready (/health/ready) once the model can serve requests
+    async def serve_model():
+        await app.state.registry.load(os.environ["MLFLOW_MODEL_VERSION"])
+        logger.info("✅ Model loaded and warmed up, API ready")
+        await app.state.jobs.start()
+        alias = os.getenv("MODEL_WATCH_ALIAS")
+        if alias and not app.state.hot_swap:
+            logger.warning(f"MODEL_WATCH_ALIAS={alias} ignored: model hot swap is disabled")
+        elif alias:
+            await app.state.registry.watch(
+                lambda: resolve_alias(alias), float(os.getenv("MODEL_WATCH_INTERVAL", "60"))
+            )
+
+    app.state.startup = asyncio.create_task(serve_model())
+
+    # Metrics read at scrape time; with several workers, each one shares its metrics with
+    # the others through METRICS_DIR
+    QUEUE_DEPTH.collect = lambda: {(): app.state.batcher.queue_depth}
+    MODEL_INFO.collect = lambda: (
+        {(current.model_id,): 1} if (current := app.state.registry.current) else {}
+    )
+    METRICS.directory = os.getenv("METRICS_DIR")
+
+    async def share_metrics(interval: float):
+        while True:
+            await asyncio.to_thread(METRICS.write_snapshot)
+            await asyncio.sleep(interval)
+
+    app.state.metrics_sync = asyncio.create_task(
+        share_metrics(float(os.getenv("METRICS_SYNC_INTERVAL", "5")))
+    )
 
     yield
     logger.info("🛑 Shutting down API lifespan")
+    app.state.startup.cancel()
+    app.state.metrics_sync.cancel()
+    await app.state.jobs.stop()
+    await app.state.batcher.stop()
+    app.state.executor.shutdown(wait=False, cancel_futures=True)
+    if app.state.prediction_log is not None:
+        await asyncio.to_thread(app.state.prediction_log.stop)
 
 
 app = FastAPI(
@@ -38,6 +154,9 @@ app = FastAPI(
 )
 
 app.include_router(predict.router)
+app.include_router(jobs.router)
+app.include_router(admin.router)
+app.include_router(health.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,6 +164,19 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Unique-Rows", "X-Scored-Rows", "Server-Timing", "X-Profile-Id"],
+)
+app.add_middleware(MetricsMiddleware, server_timing=os.getenv("SERVER_TIMING", "True") == "True")
+
+# Opt-in profiling of single requests, set up at import time as middlewares are
+app.state.profiles = ProfileStore(
+    os.getenv("PROFILES_DIR", "/tmp/codif-ape-profiles"),
+    keep=int(os.getenv("PROFILES_KEEP", "100")),
+)
+app.add_middleware(
+    ProfilingMiddleware,
+    store=app.state.profiles,
+    interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
 )
 
 
@@ -58,5 +190,26 @@ def root(
     return {
         "Message": "Codification de l'APE",
         "Model_name": f"{os.environ['MLFLOW_MODEL_NAME']}",
-        "Model_version": f"{os.environ['MLFLOW_MODEL_VERSION']}",
+        "Model_version": app.state.registry.describe()["current"],
     }
+
+
+@app.get("/cache", tags=["Welcome"])
+def cache_stats(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_credentials)],
+):
+    """
+    Show hit/miss counters of the prediction cache.
+    """
+    return app.state.prediction_cache.stats()
+
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus metrics: request counts and latencies, latency of each processing stage,
+    forms per request and per model call, queue depth, in-flight requests and model id.
+    """
+    return PlainTextResponse(
+        METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
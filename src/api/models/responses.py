@@ -1,6 +1,7 @@
-from typing import Any, Dict, Mapping, Union
+from typing import Any, Dict, Mapping, Optional, Union
 
 from pydantic import BaseModel, RootModel, model_validator
+from pydantic_core import to_json
 
 
 class Prediction(BaseModel):
@@ -78,3 +79,37 @@ class OutputResponse(RootModel[Dict[str, Union[Prediction, float, str]]]):
 
         data.root = normalized
         return data
+
+
+def build_responses(outputs: list[dict], model_id: str) -> list[dict]:
+    """
+    Attach MLversion to raw model outputs, as OutputResponse would normalize them.
+
+    All outputs of a batch come from the same model artifact, so the contract is only
+    checked on the first one; if its normalized form differs from the fast one in any
+    way, every output goes through OutputResponse.
+
+    Raises:
+        ValidationError: If the outputs do not follow the OutputResponse contract.
+    """
+    responses = [{**out, "IC": float(out["IC"]), "MLversion": model_id} for out in outputs]
+    if responses and to_json(OutputResponse(responses[0])) != to_json(responses[0]):
+        responses = [OutputResponse(response).model_dump() for response in responses]
+    return responses
+
+
+class JobStatus(BaseModel):
+    """
+    Status and progress of a bulk prediction job.
+    """
+
+    job_id: str
+    status: str  # pending, running, done or failed
+    nb_forms: int
+    nb_chunks: int
+    chunks_done: int
+    chunk_size: int
+    params: Dict[str, Any]
+    created_at: str
+    updated_at: str
+    error: Optional[str] = None
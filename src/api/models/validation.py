@@ -0,0 +1,89 @@
+"""
+Vectorized counterpart of the SingleForm / BatchForms validators.
+
+Rules are checked column by column over a whole batch and errors are reported with the
+same messages and locations as the pydantic validators.
+"""
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from api.constants.models import VALID_ACTIV_PERM, VALID_TYPE_FORM
+
+# (field, invalid rows mask, error message), in SingleForm field order. \p{Nd} matches the
+# unicode decimal digits, as `\d` does in the SingleForm validators
+FIELD_RULES = [
+    (
+        "type_form",
+        lambda col: pc.invert(pc.is_in(col, value_set=pa.array(sorted(VALID_TYPE_FORM)))),
+        lambda v: f"Invalid type_form '{v}', must be one of {VALID_TYPE_FORM}",
+    ),
+    (
+        "nature",
+        lambda col: pc.invert(pc.match_substring_regex(col, r"^\p{Nd}{2}$")),
+        lambda v: "nature must be a two-digit number (e.g., '01')",
+    ),
+    (
+        "cj",
+        lambda col: pc.invert(pc.match_substring_regex(col, r"^\p{Nd}{4}$")),
+        lambda v: "cj must be a 4-digit number (e.g., '5499')",
+    ),
+    (
+        "activity_permanence_status",
+        lambda col: pc.invert(pc.is_in(col, value_set=pa.array(sorted(VALID_ACTIV_PERM)))),
+        lambda v: f"Invalid permanence status '{v}', must be one of {VALID_ACTIV_PERM}",
+    ),
+]
+
+
+def value_error(loc: tuple, msg: str, value) -> dict:
+    return {
+        "type": "value_error",
+        "loc": loc,
+        "msg": f"Value error, {msg}",
+        "input": value,
+        "ctx": {"error": {}},
+    }
+
+
+def validate_table(table: pa.Table, loc: tuple = ("body", "forms")) -> list[dict]:
+    """
+    Check the SingleForm and BatchForms rules over a table following FORM_SCHEMA.
+
+    Null values are always valid, as `None` is for SingleForm. As with pydantic, the
+    missing description check only runs once every form is valid.
+
+    Returns:
+        list[dict]: The validation errors, empty if the table is valid.
+    """
+    errors_by_row: dict[int, list[dict]] = {}
+    for field, invalid, message in FIELD_RULES:
+        column = table.column(field)
+        if column.null_count == len(column):
+            continue
+        mask = pc.and_(pc.is_valid(column), pc.fill_null(invalid(column), False))
+        rows = pc.indices_nonzero(mask).to_pylist()
+        values = column.take(rows).to_pylist() if rows else []
+        for row, value in zip(rows, values):
+            errors_by_row.setdefault(row, []).append(
+                value_error((*loc, row, field), message(value), value)
+            )
+
+    if errors_by_row:
+        return [error for row in sorted(errors_by_row) for error in errors_by_row[row]]
+
+    description = table.column("description_activity")
+    missing = pc.or_(
+        pc.is_null(description),
+        pc.equal(pc.utf8_length(pc.utf8_trim_whitespace(description)), 0),
+    )
+    missing_indexes = pc.indices_nonzero(pc.fill_null(missing, True)).to_pylist()
+    if missing_indexes:
+        return [
+            value_error(
+                loc[:1],
+                f"The description_activity is missing at indices: {tuple(missing_indexes)}",
+                None,
+            )
+        ]
+    return []
@@ -0,0 +1,87 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPBasicCredentials
+
+from utils.security import get_admin_credentials
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+
+@router.get("/models")
+def list_models(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_admin_credentials)],
+    request: Request,
+):
+    """
+    List the resident model versions and the current one.
+    """
+    return request.app.state.registry.describe()
+
+
+@router.post("/models/{version}")
+async def load_model_version(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_admin_credentials)],
+    request: Request,
+    version: str,
+):
+    """
+    Load a model version next to the current one, warm it up and make it current.
+
+    Requests keep being served by the previous version until the swap, and can still pin
+    it afterwards for MODEL_RETENTION_SECONDS. Only available with a single API worker: with
+    several, a swap would only reach the worker answering the request.
+
+    Args:
+        version (str): The MLflow registry version of MLFLOW_MODEL_NAME to serve.
+
+    Raises:
+        HTTPException: 409 if model hot swap is disabled (several API workers), 500 if the
+                       version could not be loaded or warmed up, in which case the current
+                       version is kept.
+    """
+    if not request.app.state.hot_swap:
+        raise HTTPException(
+            status_code=409,
+            detail="Model hot swap is disabled with several API workers: "
+            "change MLFLOW_MODEL_VERSION and restart the API instead",
+        )
+    try:
+        await request.app.state.registry.load(version)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not load model version {version}: {e}")
+    return request.app.state.registry.describe()
+
+
+@router.get("/profiles")
+def list_profiles(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_admin_credentials)],
+    request: Request,
+):
+    """
+    List the stored request profiles, most recent first.
+
+    A request is profiled when sent with admin credentials and the `X-Profile: true` header;
+    its profile id is returned in the X-Profile-Id response header.
+    """
+    return request.app.state.profiles.list()
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_admin_credentials)],
+    request: Request,
+    profile_id: str,
+):
+    """
+    Return a request profile in the folded stacks format (one `frame;frame;... count` line per
+    sampled stack), to render with flamegraph.pl or speedscope.
+
+    Raises:
+        HTTPException: 404 if the profile does not exist (anymore).
+    """
+    folded = request.app.state.profiles.load(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return PlainTextResponse(folded)
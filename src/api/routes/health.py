@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+router = APIRouter(prefix="/health", tags=["Health"])
+
+
+@router.get("/live")
+def live(request: Request):
+    """
+    Liveness probe: the API process is up, and the model loading has not failed.
+    """
+    startup = request.app.state.startup
+    if startup.done() and not startup.cancelled() and startup.exception() is not None:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "failed", "error": repr(startup.exception())},
+        )
+    return {"status": "alive"}
+
+
+@router.get("/ready")
+def ready(request: Request):
+    """
+    Readiness probe: the current model version is loaded and warmed up.
+
+    Reports the current model id, its load duration and the warm-up duration per batch size.
+    """
+    current = request.app.state.registry.current
+    if current is None:
+        return JSONResponse(status_code=503, content={"status": "loading"})
+    return {"status": "ready", **current.describe()}
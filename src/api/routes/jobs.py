@@ -0,0 +1,85 @@
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPBasicCredentials
+
+from api.models.forms import BatchForms
+from api.models.responses import JobStatus
+from api.routes.body import FORMS_BODY, get_forms
+from utils.jobs import RESULT_FORMATS
+from utils.security import get_credentials
+
+router = APIRouter(prefix="/jobs", tags=["Bulk prediction jobs"])
+
+
+@router.post("/", response_model=JobStatus, status_code=202, openapi_extra=FORMS_BODY)
+async def submit_job(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_credentials)],
+    request: Request,
+    forms: Annotated[BatchForms, Depends(get_forms)],
+    nb_echos_max: int = 5,
+    prob_min: float = 0.01,
+):
+    """
+    Submit a batch of forms to be predicted in the background.
+
+    Args:
+        credentials (HTTPBasicCredentials): The credentials for authentication.
+        forms (Forms): The input data in the form of Forms object.
+        nb_echos_max (int, optional): The maximum number of predictions to return. Defaults to 5.
+        prob_min (float, optional): The minimum probability threshold for predictions.
+                                    Defaults to 0.01.
+
+    Returns:
+        JobStatus: The created job, whose id is used to poll its status and get its results.
+    """
+    return await request.app.state.jobs.submit(
+        [form.model_dump() for form in forms.forms],
+        {"nb_echos_max": nb_echos_max, "prob_min": prob_min},
+    )
+
+
+@router.get("/{job_id}", response_model=JobStatus)
+def get_job(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_credentials)],
+    request: Request,
+    job_id: str,
+):
+    """
+    Get the status and progress of a job.
+    """
+    return find_job(request, job_id)
+
+
+@router.get("/{job_id}/results")
+def get_job_results(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_credentials)],
+    request: Request,
+    job_id: str,
+    format: Literal["ndjson", "parquet"] = "ndjson",
+):
+    """
+    Download the results of a finished job, in the input order.
+
+    Args:
+        job_id (str): The job id.
+        format (str, optional): "ndjson" (one OutputResponse per line) or "parquet"
+                                (one column per field and rank, e.g. code_1). Defaults to "ndjson".
+    """
+    job = find_job(request, job_id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job['status']}")
+
+    return StreamingResponse(
+        request.app.state.jobs.storage.read_results(job_id, format),
+        media_type=RESULT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{job_id}.{format}"'},
+    )
+
+
+def find_job(request: Request, job_id: str) -> dict:
+    job = request.app.state.jobs.get(job_id) if job_id.isalnum() else None
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
@@ -1,24 +1,40 @@
-from typing import Annotated, List
+import asyncio
+import os
+from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, Request
+import pyarrow as pa
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBasicCredentials
+from pydantic_core import to_json
 
-from api.models.forms import BatchForms
-from api.models.responses import OutputResponse
+from api.models.forms import BatchForms, SingleForm
+from api.models.responses import OutputResponse, build_responses
+from api.models.validation import validate_table
+from api.routes.body import FORMS_BODY, get_forms
+from utils.batching import BatcherOverloadedError
+from utils.columnar import MEDIA_TYPES, negotiate, outputs_to_table, read_table, write_table
+from utils.inference import Predictions, PredictParams, predict_forms
+from utils.metrics import stage
+from utils.registry import ModelNotReadyError, ModelVersion, ModelVersionNotFoundError
 from utils.security import get_credentials
 
+JSON = "application/json"
+
 router = APIRouter(prefix="/predict", tags=["Predict NACE code for a list of activities"])
 
 
-@router.post("/", response_model=List[OutputResponse])
+@router.post("/", response_model=List[OutputResponse], openapi_extra=FORMS_BODY)
 async def predict(
     credentials: Annotated[HTTPBasicCredentials, Depends(get_credentials)],
     request: Request,
-    forms: BatchForms,
+    forms: Annotated[BatchForms, Depends(get_forms)],
     nb_echos_max: int = 5,
     prob_min: float = 0.01,
-    num_workers: int = 0,
-    batch_size: int = 1,
+    model_version: Optional[str] = None,
+    num_workers: Annotated[int, Query(deprecated=True)] = 0,
+    batch_size: Annotated[int, Query(deprecated=True)] = 1,
 ):
     """
     Endpoint for predicting batches of data.
@@ -29,34 +45,226 @@ async def predict(
         nb_echos_max (int, optional): The maximum number of predictions to return. Defaults to 5.
         prob_min (float, optional): The minimum probability threshold for predictions.
                                     Defaults to 0.01.
-        num_workers (int, optional): Number of CPU for multiprocessing in Dataloader.
-                                     Defaults to 1.
-        batch_size (int, optional): Size of a batch for batch prediction.
+        model_version (str, optional): Pin a resident model version instead of the current one.
+        num_workers (int, optional): Deprecated and ignored, the server chooses the number
+                                     of DataLoader workers from the batch length.
+        batch_size (int, optional): Deprecated and ignored, the server chooses the DataLoader
+                                    batch size from the batch length.
+
+    Concurrent requests sharing the same parameters are merged server-side into a single
+    model call (see PREDICT_MAX_BATCH_SIZE and PREDICT_MAX_WAIT_MS). Forms already scored
+    with the same parameters and model are answered from an in-memory cache.
 
-    For single predictions, we recommend keeping num_workers and batch_size to 1
-        for better performance.
-    For batched predictions, consider increasing these two parameters
-        (num_workers can range from 4 to 12, batch size can be increased up to 256)
-        to optimize performance.
+    Identical forms of the batch are scored once; the X-Unique-Rows response header holds
+    the number of distinct forms and X-Scored-Rows the number actually run through the
+    model (the others came from the cache).
+
+    The output contract is checked once per batch and the response is serialized straight
+    to JSON bytes (the response_model only documents the schema).
 
     Returns:
         list: The list of predicted responses.
+
+    Raises:
+        HTTPException: 404 if the pinned model version is not loaded, 503 with a Retry-After
+                       header if the model is still loading or too many requests are pending.
+    """
+    params = PredictParams(nb_echos_max, prob_min)
+    model = get_model(request, model_version)
+
+    try:
+        predictions = await predict_forms(request.app.state, forms.forms, params, model)
+    except BatcherOverloadedError as e:
+        raise overloaded_error(e)
+
+    with stage("response"):
+        responses = build_responses(predictions.outputs, model.model_id)
+    log_predictions(request, forms.forms, responses)
+    with stage("serialization"):
+        content = to_json(responses)
+    return Response(content=content, media_type=JSON, headers=rows_headers(predictions))
+
+
+@router.post("/stream", response_class=StreamingResponse, openapi_extra=FORMS_BODY)
+async def predict_stream(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_credentials)],
+    request: Request,
+    forms: Annotated[BatchForms, Depends(get_forms)],
+    nb_echos_max: int = 5,
+    prob_min: float = 0.01,
+    model_version: Optional[str] = None,
+):
     """
-    input_data = forms.forms
-
-    params_dict = {
-        "nb_echos_max": nb_echos_max,
-        "prob_min": prob_min,
-        "dataloader_params": {
-            "pin_memory": False,
-            "persistent_workers": False,
-            "num_workers": num_workers,
-            "batch_size": batch_size,
-        },
+    Endpoint for predicting large batches of data as a stream.
+
+    Forms are scored in chunks of STREAM_CHUNK_SIZE forms and the response is written as
+    newline-delimited JSON (one OutputResponse per line, in the input order) as soon as
+    each chunk is scored. Identical forms within a chunk are scored once.
+
+    Args:
+        credentials (HTTPBasicCredentials): The credentials for authentication.
+        forms (Forms): The input data in the form of Forms object.
+        nb_echos_max (int, optional): The maximum number of predictions to return. Defaults to 5.
+        prob_min (float, optional): The minimum probability threshold for predictions.
+                                    Defaults to 0.01.
+        model_version (str, optional): Pin a resident model version instead of the current one.
+
+    Returns:
+        StreamingResponse: The predicted responses as application/x-ndjson.
+
+    Raises:
+        HTTPException: 404 if the pinned model version is not loaded, 503 with a Retry-After
+                       header if the model is still loading or too many requests are pending.
+    """
+    params = PredictParams(nb_echos_max, prob_min)
+    model = get_model(request, model_version)
+    chunk_size = int(os.getenv("STREAM_CHUNK_SIZE", "256"))
+    chunks = [forms.forms[i : i + chunk_size] for i in range(0, len(forms.forms), chunk_size)]
+
+    # The first chunk is scored before answering so that overload is still reported as 503
+    try:
+        first = (
+            (await predict_forms(request.app.state, chunks[0], params, model)).outputs
+            if chunks
+            else []
+        )
+    except BatcherOverloadedError as e:
+        raise overloaded_error(e)
+
+    async def lines():
+        if chunks:
+            yield to_ndjson(request, chunks[0], first, model.model_id)
+        for chunk in chunks[1:]:
+            while True:
+                try:
+                    predictions = await predict_forms(request.app.state, chunk, params, model)
+                    break
+                except BatcherOverloadedError:
+                    # Once streaming has started, wait for room in the queue instead
+                    await asyncio.sleep(float(os.getenv("PREDICT_RETRY_AFTER", "1")))
+            yield to_ndjson(request, chunk, predictions.outputs, model.model_id)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post(
+    "/table",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                media_type: {"schema": {"type": "string", "format": "binary"}}
+                for media_type in sorted(set(MEDIA_TYPES.values()))
+            },
+        }
+    },
+)
+async def predict_table(
+    credentials: Annotated[HTTPBasicCredentials, Depends(get_credentials)],
+    request: Request,
+    nb_echos_max: int = 5,
+    prob_min: float = 0.01,
+    model_version: Optional[str] = None,
+):
+    """
+    Endpoint for predicting batches of data sent in a columnar format.
+
+    The body is an Arrow IPC stream or file, a Parquet file or a CSV file (chosen from the
+    Content-Type header) with one column per SingleForm field; only description_activity
+    is required. The SingleForm rules are checked over whole columns at once.
+
+    The response holds one row per form, in the input order, with the columns code_1,
+    probabilite_1, libelle_1, ..., IC and MLversion. Its format is chosen from the Accept
+    header and defaults to the format of the request. Identical rows are scored once, see
+    the X-Unique-Rows and X-Scored-Rows headers of `/predict`.
+
+    Args:
+        credentials (HTTPBasicCredentials): The credentials for authentication.
+        nb_echos_max (int, optional): The maximum number of predictions to return. Defaults to 5.
+        prob_min (float, optional): The minimum probability threshold for predictions.
+                                    Defaults to 0.01.
+        model_version (str, optional): Pin a resident model version instead of the current one.
+
+    Raises:
+        HTTPException: 415 for an unsupported Content-Type, 400 for an unreadable body,
+                       404 if the pinned model version is not loaded, 503 with a
+                       Retry-After header if the model is still loading or too many
+                       requests are pending.
+    """
+    media_type = negotiate(request.headers.get("content-type"))
+    if media_type is None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Content-Type must be one of {sorted(set(MEDIA_TYPES.values()))}",
+        )
+    response_type = negotiate(request.headers.get("accept")) or media_type
+
+    body = await request.body()
+    try:
+        with stage("parsing"):
+            table = await asyncio.to_thread(read_table, body, media_type)
+    except (pa.ArrowException, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read {media_type} body: {e}")
+
+    with stage("validation"):
+        errors = validate_table(table)
+        if errors:
+            raise RequestValidationError(errors)
+
+        # Rows are already validated column-wise
+        forms = [SingleForm.model_construct(**row) for row in table.to_pylist()]
+    params = PredictParams(nb_echos_max, prob_min)
+    model = get_model(request, model_version)
+
+    try:
+        predictions = await predict_forms(request.app.state, forms, params, model)
+    except BatcherOverloadedError as e:
+        raise overloaded_error(e)
+
+    with stage("response"):
+        responses = build_responses(predictions.outputs, model.model_id)
+        result = outputs_to_table(responses, nb_echos_max)
+    log_predictions(request, forms, responses)
+    with stage("serialization"):
+        content = await asyncio.to_thread(write_table, result, response_type)
+    return Response(content=content, media_type=response_type, headers=rows_headers(predictions))
+
+
+def get_model(request: Request, model_version: Optional[str]) -> ModelVersion:
+    try:
+        return request.app.state.registry.get(model_version)
+    except ModelNotReadyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": os.getenv("PREDICT_RETRY_AFTER", "1")},
+        )
+    except ModelVersionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+
+def overloaded_error(e: BatcherOverloadedError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": os.getenv("PREDICT_RETRY_AFTER", "1")},
+    )
+
+
+def rows_headers(predictions: Predictions) -> dict[str, str]:
+    return {
+        "X-Unique-Rows": str(predictions.nb_unique),
+        "X-Scored-Rows": str(predictions.nb_scored),
     }
 
-    output = request.app.state.model.predict(input_data, params=params_dict)
-    return [
-        OutputResponse({**out.model_dump(), "MLversion": request.app.state.model_id})
-        for out in output
-    ]
+
+def log_predictions(request: Request, forms: list, responses: list[dict]):
+    prediction_log = request.app.state.prediction_log
+    if prediction_log is not None:
+        prediction_log.log(forms, responses)
+
+
+def to_ndjson(request: Request, forms: list, outputs: list[dict], model_id: str) -> bytes:
+    responses = build_responses(outputs, model_id)
+    log_predictions(request, forms, responses)
+    return b"".join(to_json(row) + b"\n" for row in responses)
@@ -0,0 +1,151 @@
+"""
+Multi-process serving: load the model once, then fork the API workers.
+
+The parent process loads the model before forking, so every worker shares its pages (torch
+weights, NLTK data) copy-on-write instead of loading its own copy: the weights are only read
+by inference, and the garbage collector is kept from writing to them (`gc.freeze`). They are
+not moved to shared memory, which would need a /dev/shm larger than the 64 MB containers get
+by default. Workers share the listening socket; the parent restarts any worker that dies, waiting
+longer and longer between the restarts of a worker that keeps crashing.
+
+A model hot swap (`/admin/models`, MODEL_WATCH_ALIAS) would only reach one worker and load
+its own copy of the weights, so it is disabled as soon as there are several workers.
+
+Usage (from src/):
+    uv run python -m api.serve
+"""
+
+import gc
+import glob
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import torch
+import uvicorn
+
+from api.main import app
+from utils.load_model import PRELOADED_MODELS, load_model
+from utils.logging import configure_logging
+from utils.resources import configure_resources
+
+logger = logging.getLogger(__name__)
+
+# Delay (seconds) before restarting a crashed worker, doubled at each new crash of a worker
+# that ran for less than RESTART_RESET seconds, up to RESTART_MAX_DELAY
+RESTART_MIN_DELAY = 1
+RESTART_MAX_DELAY = 60
+RESTART_RESET = 60
+
+
+def preload_model():
+    """
+    Load the served model version into PRELOADED_MODELS, to be inherited by the workers.
+    """
+    version = os.environ["MLFLOW_MODEL_VERSION"]
+    PRELOADED_MODELS[version] = load_model(version)
+
+    # Objects allocated so far are never freed: keep the garbage collector from touching
+    # (and thus copying) their pages in the workers
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(index: int, sock: socket.socket, nb_workers: int):
+    # Only the first worker runs the bulk prediction jobs
+    os.environ["JOBS_RUNNER"] = "True" if index == 0 else "False"
+    # A swap would only reach one worker, and would not share its weights with the others
+    os.environ["MODEL_HOT_SWAP"] = "True" if nb_workers == 1 else "False"
+
+    config = uvicorn.Config(app, log_config=None, timeout_graceful_shutdown=30)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    configure_logging()
+    host = os.getenv("API_HOST", "0.0.0.0")
+    port = int(os.getenv("API_PORT", "5000"))
+    nb_workers = configure_resources()["API_WORKERS"]
+
+    # Single-threaded torch in the parent: its thread pools are not inherited across fork,
+    # each worker sets its own TORCH_NUM_THREADS at startup
+    torch.set_num_threads(1)
+    preload_model()
+    logger.info(f"Model preloaded, starting {nb_workers} workers")
+
+    # Workers share their metrics through METRICS_DIR, emptied of the previous runs
+    if "METRICS_DIR" not in os.environ:
+        os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="codif-ape-metrics-")
+    metrics_dir = os.environ["METRICS_DIR"]
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        os.remove(path)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+
+    if nb_workers == 1:
+        run_worker(0, sock, nb_workers)
+        return
+
+    workers: dict[int, int] = {}
+    started: dict[int, float] = {}
+    restart_delays: dict[int, float] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 1
+            try:
+                run_worker(index, sock, nb_workers)
+                code = 0
+            finally:
+                os._exit(code)
+        workers[pid] = index
+        started[index] = time.monotonic()
+
+    def stop(signum, _):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(nb_workers):
+        spawn(index)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        if time.monotonic() - started[index] >= RESTART_RESET:
+            delay = RESTART_MIN_DELAY
+        else:
+            delay = min(2 * restart_delays.get(index, RESTART_MIN_DELAY / 2), RESTART_MAX_DELAY)
+        restart_delays[index] = delay
+        logger.error(
+            f"Worker {index} (pid {pid}) exited with status {status}, restarting it in {delay}s"
+        )
+        time.sleep(delay)
+        if not stopping:
+            spawn(index)
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
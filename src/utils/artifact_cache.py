@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tree_files(root: str) -> list[str]:
+    """
+    Return the path of every file under `root`, relative to it.
+    """
+    return sorted(
+        os.path.relpath(os.path.join(dirpath, filename), root)
+        for dirpath, _, filenames in os.walk(root)
+        for filename in filenames
+    )
+
+
+def file_info(path: str) -> dict:
+    stat = os.stat(path)
+    return {"sha256": file_sha256(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def tree_checksum(files: dict[str, dict]) -> str:
+    checksums = {name: info["sha256"] for name, info in files.items()}
+    return hashlib.sha256(json.dumps(checksums, sort_keys=True).encode()).hexdigest()
+
+
+class ArtifactCache:
+    """
+    Persistent local cache of model artifacts, one entry per model name and version.
+
+    Layout: `root/<name>/<version>/{manifest.json, model/}`. The manifest holds the sha256,
+    size and modification time of every artifact file, the checksum of the whole artifact and
+    the registry source it was downloaded from. Entries are written to a temporary directory
+    first and moved in place once complete, so a download interrupted by a restart never ends
+    up in the cache.
+
+    The verification detects cache entries altered after their download (truncated copies,
+    disk errors, manual edits): the manifest is written by the cache itself, from the files as
+    downloaded, so it does not vouch for the download. Only files whose modification time
+    changed are hashed again, a startup with an intact cache only reads file metadata.
+
+    Args:
+        root (str): Cache directory, typically a persistent volume.
+        keep_versions (int): Number of versions kept per model name, least recently used
+                             ones are evicted first (0 keeps everything).
+        verify (bool): Whether to check the files against their manifest before use.
+    """
+
+    def __init__(self, root: str, keep_versions: int = 2, verify: bool = True):
+        self.root = root
+        self.keep_versions = keep_versions
+        self.verify = verify
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str, *parts: str) -> str:
+        return os.path.join(self.root, name, *parts)
+
+    def load_manifest(self, name: str, version: str) -> Optional[dict]:
+        try:
+            with open(self._path(name, version, MANIFEST)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def is_valid(self, name: str, version: str, manifest: dict) -> bool:
+        """
+        Check a cache entry against its manifest: file list and, if `verify`, the size of the
+        files and the sha256 of those modified since the download.
+        """
+        model_path = self._path(name, version, "model")
+        files = manifest["files"]
+        if not self.verify:
+            return all(os.path.isfile(os.path.join(model_path, f)) for f in files)
+        # Manifests written before sizes and modification times were recorded
+        if not all(isinstance(info, dict) for info in files.values()):
+            return False
+        try:
+            if tree_files(model_path) != sorted(files):
+                return False
+            for filename, info in files.items():
+                path = os.path.join(model_path, filename)
+                stat = os.stat(path)
+                if stat.st_size != info["size"]:
+                    return False
+                if stat.st_mtime_ns != info["mtime_ns"] and file_sha256(path) != info["sha256"]:
+                    return False
+        except OSError:
+            return False
+        return tree_checksum(files) == manifest["checksum"]
+
+    def get(self, name: str, version: str, source: Optional[str] = None) -> Optional[str]:
+        """
+        Return the artifact path of a cached version, if present and valid.
+
+        Args:
+            source (str, optional): Registry source of the version; when given, an entry
+                                    downloaded from another source is stale.
+        """
+        manifest = self.load_manifest(name, version)
+        if manifest is None:
+            return None
+        if source is not None and manifest.get("source") != source:
+            logger.info(f"Cached {name}/{version} comes from another source, ignoring it")
+            return None
+        if not self.is_valid(name, version, manifest):
+            logger.warning(f"Cached {name}/{version} failed integrity verification, ignoring it")
+            return None
+
+        # The manifest modification time tracks the last use, for eviction
+        os.utime(self._path(name, version, MANIFEST))
+        return self._path(name, version, "model")
+
+    def put(
+        self,
+        name: str,
+        version: str,
+        download: Callable[[str], None],
+        source: Optional[str] = None,
+    ) -> str:
+        """
+        Download a version with `download(dst_path)` and store it in the cache.
+
+        Returns:
+            str: The artifact path of the cached version.
+        """
+        tmp_path = self._path(name, f".tmp-{uuid.uuid4().hex}")
+        try:
+            model_path = os.path.join(tmp_path, "model")
+            download(model_path)
+            files = {
+                filename: file_info(os.path.join(model_path, filename))
+                for filename in tree_files(model_path)
+            }
+            manifest = {
+                "name": name,
+                "version": version,
+                "source": source,
+                "checksum": tree_checksum(files),
+                "files": files,
+                "downloaded_at": time.time(),
+            }
+            with open(os.path.join(tmp_path, MANIFEST), "w") as f:
+                json.dump(manifest, f)
+
+            shutil.rmtree(self._path(name, version), ignore_errors=True)
+            os.replace(tmp_path, self._path(name, version))
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict(name, keep=version)
+        return self._path(name, version, "model")
+
+    def evict(self, name: str, keep: Optional[str] = None):
+        """
+        Remove the least recently used versions of a model beyond `keep_versions`.
+        """
+        if self.keep_versions <= 0:
+            return
+
+        def last_used(version: str) -> float:
+            try:
+                return os.path.getmtime(self._path(name, version, MANIFEST))
+            except OSError:
+                return 0.0
+
+        versions = [v for v in os.listdir(self._path(name)) if not v.startswith(".tmp-")]
+        versions.sort(key=lambda v: (v == keep, last_used(v)), reverse=True)
+        for version in versions[self.keep_versions :]:
+            logger.info(f"Evicting {name}/{version} from the model cache")
+            shutil.rmtree(self._path(name, version), ignore_errors=True)
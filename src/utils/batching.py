@@ -0,0 +1,192 @@
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, List
+
+logger = logging.getLogger(__name__)
+
+
+class BatcherOverloadedError(Exception):
+    """
+    Raised when the pending queue of the batcher is full.
+    """
+
+
+class BatcherStoppedError(BatcherOverloadedError):
+    """
+    Raised to the requests still waiting for their outputs when the batcher stops. Like an
+    overload, the request can be retried (e.g. on another worker).
+    """
+
+
+@dataclass
+class PendingPrediction:
+    forms: list
+    key: Hashable
+    future: asyncio.Future = field(repr=False)
+    # Context of the submitting request, captured when it is queued
+    context: contextvars.Context = field(default_factory=contextvars.copy_context, repr=False)
+
+
+class PredictionBatcher:
+    """
+    Merge concurrent prediction requests into a single model call.
+
+    Requests are queued and a background task drains the queue: it waits at most
+    `max_wait_ms` after the first pending request for others to arrive, up to
+    `max_batch_size` forms, then calls `predict_fn` once per group of requests sharing
+    the same prediction parameters. Each caller only gets back the rows of its own forms.
+
+    Model calls run in `executor`, never on the event loop, with at most `max_concurrency`
+    of them in flight. When `max_pending` requests are already waiting, new requests are
+    rejected with `BatcherOverloadedError` instead of queueing without bound.
+
+    A model call runs in a copy of the context of the first request of its group, so that
+    what `predict_fn` records about the current request (e.g. stage timings) is attributed
+    to that request.
+
+    Args:
+        predict_fn (Callable): Function called as `predict_fn(forms, key)` and returning
+                               one output per form, in order.
+        max_batch_size (int): Maximum number of forms merged into a single model call.
+        max_wait_ms (float): Maximum time to wait for other requests before running a batch.
+        executor (Executor, optional): Executor running the model calls.
+                                       Defaults to the event loop default executor.
+        max_concurrency (int): Maximum number of model calls running at the same time.
+        max_pending (int): Maximum number of requests waiting in the queue (0 for unbounded).
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[list, Hashable], List[Any]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        executor: Executor | None = None,
+        max_concurrency: int = 1,
+        max_pending: int = 0,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self._queue: asyncio.Queue[PendingPrediction] = asyncio.Queue(maxsize=max_pending)
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._dispatches: set[asyncio.Task] = set()
+        self._worker: asyncio.Task | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the batcher. Requests still queued or being predicted fail with
+        `BatcherStoppedError` instead of waiting forever.
+        """
+        tasks = [self._worker] if self._worker is not None else []
+        tasks.extend(self._dispatches)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+
+        while not self._queue.empty():
+            self._fail([self._queue.get_nowait()])
+
+    def _fail(self, batch: List[PendingPrediction]):
+        for pending in batch:
+            if not pending.future.done():
+                pending.future.set_exception(BatcherStoppedError("The prediction batcher stopped"))
+
+    async def submit(self, forms: list, key: Hashable) -> list:
+        """
+        Queue forms for prediction and wait for their outputs.
+
+        Args:
+            forms (list): The forms to predict.
+            key (Hashable): Prediction parameters; only requests with equal keys are merged.
+
+        Returns:
+            list: One output per form, in the same order as `forms`.
+
+        Raises:
+            BatcherOverloadedError: If the pending queue is full.
+        """
+        if not forms:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(PendingPrediction(forms=forms, key=key, future=future))
+        except asyncio.QueueFull:
+            raise BatcherOverloadedError(
+                f"Too many pending prediction requests ({self._queue.maxsize})"
+            )
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0].forms)
+            deadline = loop.time() + self.max_wait
+
+            try:
+                while size < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        pending = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    batch.append(pending)
+                    size += len(pending.forms)
+
+                groups: dict[Hashable, List[PendingPrediction]] = {}
+                for pending in batch:
+                    groups.setdefault(pending.key, []).append(pending)
+
+                for key, group in groups.items():
+                    # Wait for a free inference slot: meanwhile new requests pile up in the
+                    # bounded queue, which is what triggers load shedding under bursts
+                    await self._slots.acquire()
+                    task = asyncio.create_task(self._dispatch(key, group))
+                    self._dispatches.add(task)
+                    task.add_done_callback(self._dispatches.discard)
+            except asyncio.CancelledError:
+                # Requests taken out of the queue and not dispatched yet
+                self._fail(batch)
+                raise
+
+    async def _dispatch(self, key: Hashable, group: List[PendingPrediction]):
+        forms = [form for pending in group for form in pending.forms]
+        loop = asyncio.get_running_loop()
+        try:
+            context = group[0].context
+            outputs = list(
+                await loop.run_in_executor(self.executor, context.run, self.predict_fn, forms, key)
+            )
+        except asyncio.CancelledError:
+            self._fail(group)
+            raise
+        except Exception as e:
+            logger.exception("Batched prediction failed")
+            for pending in group:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        start = 0
+        for pending in group:
+            end = start + len(pending.forms)
+            if not pending.future.done():
+                pending.future.set_result(outputs[start:end])
+            start = end
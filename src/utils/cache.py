@@ -0,0 +1,100 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from api.models.forms import SingleForm
+
+
+def form_key(form: SingleForm) -> tuple:
+    """
+    Cache key of a form: its exact field values.
+
+    Texts are not normalized: nothing guarantees that the model cleaning ignores case and
+    spacing, so "VTC" and "vtc " are predicted apart.
+    """
+    return (
+        form.description_activity,
+        form.other_nature_activity,
+        form.precision_act_sec_agricole,
+        form.type_form,
+        form.nature,
+        form.surface,
+        form.cj,
+        form.activity_permanence_status,
+    )
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of model outputs with a time-to-live.
+
+    Entries are tied to a model: as soon as `ensure_model` is called with a different
+    model id, the whole cache is cleared.
+
+    Args:
+        max_size (int): Maximum number of entries, least recently used ones are evicted first.
+                        A size of 0 disables the cache.
+        ttl_seconds (float): Lifetime of an entry (0 for no expiration).
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self.model_id: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    @staticmethod
+    def key(form: SingleForm, nb_echos_max: int, prob_min: float, model_id: str) -> tuple:
+        return (form_key(form), nb_echos_max, prob_min, model_id)
+
+    def ensure_model(self, model_id: str):
+        if model_id != self.model_id:
+            self.clear()
+            self.model_id = model_id
+
+    def clear(self):
+        self._entries.clear()
+
+    def get(self, key: Hashable) -> Any:
+        if self.max_size <= 0:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if self.ttl and expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "model_id": self.model_id,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
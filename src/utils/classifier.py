@@ -0,0 +1,25 @@
+"""
+Access to the torchTextClassifiers classifier wrapped in the MLflow pyfunc model.
+"""
+
+from typing import Any, Optional
+
+from torch import nn
+
+
+def find_classifier(model) -> Optional[Any]:
+    """
+    Find the torchTextClassifiers instance held by a pyfunc model, if any.
+
+    The python model of the artifact is duck-typed: the classifier is the attribute exposing
+    a `pytorch_model` torch module.
+    """
+    try:
+        python_model = model.unwrap_python_model()
+    except Exception:
+        return None
+
+    for candidate in (python_model, *vars(python_model).values()):
+        if isinstance(getattr(candidate, "pytorch_model", None), nn.Module):
+            return candidate
+    return None
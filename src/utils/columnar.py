@@ -0,0 +1,154 @@
+import io
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+PARQUET = "application/vnd.apache.parquet"
+CSV = "text/csv"
+
+MEDIA_TYPES = {
+    ARROW_STREAM: ARROW_STREAM,
+    ARROW_FILE: ARROW_FILE,
+    PARQUET: PARQUET,
+    "application/x-parquet": PARQUET,
+    CSV: CSV,
+}
+
+# Columnar counterpart of SingleForm
+FORM_SCHEMA = pa.schema(
+    [
+        pa.field("description_activity", pa.string()),
+        pa.field("other_nature_activity", pa.string()),
+        pa.field("precision_act_sec_agricole", pa.string()),
+        pa.field("type_form", pa.string()),
+        pa.field("nature", pa.string()),
+        pa.field("surface", pa.float64()),
+        pa.field("cj", pa.string()),
+        pa.field("activity_permanence_status", pa.string()),
+    ]
+)
+
+
+def negotiate(header: str | None) -> str | None:
+    """
+    Return the supported columnar media type of a Content-Type or Accept header, if any.
+    """
+    for media_type in (header or "").split(","):
+        media_type = media_type.split(";")[0].strip().lower()
+        if media_type in MEDIA_TYPES:
+            return MEDIA_TYPES[media_type]
+    return None
+
+
+def read_table(body: bytes, media_type: str) -> pa.Table:
+    """
+    Read a request body into a table following FORM_SCHEMA.
+
+    Missing optional columns are filled with nulls and extra columns are dropped.
+    In CSV, only empty cells are nulls ("NaN" is a valid type_form value), and codes
+    are read as strings to keep their leading zeros.
+    """
+    if media_type == ARROW_STREAM:
+        table = ipc.open_stream(body).read_all()
+    elif media_type == ARROW_FILE:
+        table = ipc.open_file(body).read_all()
+    elif media_type == PARQUET:
+        table = pq.read_table(io.BytesIO(body))
+    else:
+        table = pa_csv.read_csv(
+            io.BytesIO(body),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=FORM_SCHEMA,
+                null_values=[""],
+                strings_can_be_null=True,
+            ),
+        )
+
+    columns = [
+        table.column(field.name).cast(field.type)
+        if field.name in table.column_names
+        else pa.nulls(table.num_rows, field.type)
+        for field in FORM_SCHEMA
+    ]
+    return pa.Table.from_arrays(columns, schema=FORM_SCHEMA)
+
+
+def write_table(table: pa.Table, media_type: str) -> bytes:
+    sink = pa.BufferOutputStream()
+    if media_type == ARROW_STREAM:
+        with ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    elif media_type == ARROW_FILE:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    elif media_type == PARQUET:
+        pq.write_table(table, sink)
+    else:
+        pa_csv.write_csv(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+def results_schema(nb_echos_max: int) -> pa.Schema:
+    fields = []
+    for rank in range(1, nb_echos_max + 1):
+        fields += [
+            pa.field(f"code_{rank}", pa.string()),
+            pa.field(f"probabilite_{rank}", pa.float64()),
+            pa.field(f"libelle_{rank}", pa.string()),
+        ]
+    return pa.schema(fields + [pa.field("IC", pa.float64()), pa.field("MLversion", pa.string())])
+
+
+def prediction_log_schema(nb_echos_max: int) -> pa.Schema:
+    """
+    Schema of the prediction logs read by the dashboard: the prediction events flattened with
+    dots as `pandas.json_normalize` does (Timestamp, Query.<field>, Response.<rank>.code, ...,
+    Response.IC, Response.MLversion).
+    """
+    fields = [pa.field("Timestamp", pa.timestamp("ns"))]
+    fields += [pa.field(f"Query.{field.name}", field.type) for field in FORM_SCHEMA]
+    for rank in range(1, nb_echos_max + 1):
+        fields += [
+            pa.field(f"Response.{rank}.code", pa.string()),
+            pa.field(f"Response.{rank}.probabilite", pa.float64()),
+            pa.field(f"Response.{rank}.libelle", pa.string()),
+        ]
+    fields += [pa.field("Response.IC", pa.float64()), pa.field("Response.MLversion", pa.string())]
+    return pa.schema(fields)
+
+
+def flatten_event(event: dict) -> dict:
+    """
+    Flatten a prediction event into the columns of `prediction_log_schema`.
+    """
+    row = {"Timestamp": event["Timestamp"]}
+    for field, value in event["Query"].items():
+        row[f"Query.{field}"] = value
+    for key, value in event["Response"].items():
+        if key.isdigit():
+            for field, field_value in value.items():
+                row[f"Response.{key}.{field}"] = field_value
+        else:
+            row[f"Response.{key}"] = value
+    return row
+
+
+def flatten_output(row: dict) -> dict:
+    """
+    Flatten an OutputResponse into columns: code_1, probabilite_1, libelle_1, ..., IC, MLversion.
+    """
+    flat = {"IC": row["IC"], "MLversion": row["MLversion"]}
+    for rank, prediction in row.items():
+        if rank.isdigit():
+            for field, value in prediction.items():
+                flat[f"{field}_{rank}"] = value
+    return flat
+
+
+def outputs_to_table(outputs: list[dict], nb_echos_max: int) -> pa.Table:
+    schema = results_schema(nb_echos_max)
+    return pa.Table.from_pylist([flatten_output(row) for row in outputs], schema=schema)
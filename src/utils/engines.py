@@ -0,0 +1,114 @@
+"""
+Inference engines of the torchTextClassifiers network wrapped in the MLflow pyfunc model.
+
+The pyfunc wrapper keeps tokenization, categorical encoding and post-processing; an engine
+only replaces the torch module called for the forward pass, so every engine is built from the
+same artifact at load time and the outputs keep the same contract. An engine is only used
+once its outputs on PARITY_FORMS match the eager ones (see `apply_engine`).
+"""
+
+import logging
+from typing import Any, Callable
+
+import torch
+from torch import nn
+
+from utils.classifier import find_classifier
+
+logger = logging.getLogger(__name__)
+
+
+def quantize(module: nn.Module) -> nn.Module:
+    """
+    Dynamic int8 quantization of the linear layers: weights are stored in int8 and the
+    activations quantized on the fly, the rest of the module (embeddings) is left in float32.
+    """
+    return torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8)
+
+
+# Builders of the forward pass module of each engine, from the eager module
+ENGINES: dict[str, Callable[[nn.Module], nn.Module]] = {
+    "eager": lambda module: module,
+    "quantized": quantize,
+}
+
+
+def compare_outputs(reference: list[dict], outputs: list[dict]) -> dict:
+    """
+    Compare the outputs of an engine with the eager ones, rank by rank.
+
+    Returns:
+        dict: The share of forms with the same top-k codes, and the largest IC difference.
+    """
+    same_codes = sum(
+        [ref[rank]["code"] for rank in ref if rank.isdigit()]
+        == [out[rank]["code"] for rank in out if rank.isdigit()]
+        for ref, out in zip(reference, outputs, strict=True)
+    )
+    max_ic_diff = max(
+        (abs(ref["IC"] - out["IC"]) for ref, out in zip(reference, outputs)), default=0.0
+    )
+    return {
+        "codes_agreement": same_codes / len(reference) if reference else 1.0,
+        "max_ic_diff": max_ic_diff,
+    }
+
+
+def apply_engine(
+    model,
+    name: str,
+    predict_sample: Callable[[Any], list[dict]],
+    min_agreement: float = 0.99,
+    ic_tolerance: float = 0.05,
+) -> dict:
+    """
+    Switch the forward pass of a pyfunc model to an inference engine, after an accuracy
+    parity check against eager mode.
+
+    The model is left in eager mode if the artifact does not expose a torchTextClassifiers
+    classifier, if the engine cannot be built, or if it fails the parity check.
+
+    Args:
+        model: The MLflow pyfunc model.
+        name (str): The engine, one of ENGINES.
+        predict_sample (Callable): Called as `predict_sample(model)`, returning the dumped
+                                   outputs of the model on the parity forms.
+        min_agreement (float): Minimum share of parity forms with the same top-k codes.
+        ic_tolerance (float): Maximum IC difference on a parity form.
+
+    Returns:
+        dict: The engine in use and the parity check results.
+
+    Raises:
+        ValueError: If the engine is unknown.
+    """
+    if name not in ENGINES:
+        raise ValueError(f"Unknown inference engine '{name}', must be one of {sorted(ENGINES)}")
+    report = {"engine": "eager", "requested": name}
+    if name == "eager":
+        return report
+
+    classifier = find_classifier(model)
+    if classifier is None:
+        logger.warning(f"No torchTextClassifiers module found in the model, {name} not applied")
+        return report
+
+    eager = classifier.pytorch_model
+    try:
+        reference = predict_sample(model)
+        classifier.pytorch_model = ENGINES[name](eager)
+        parity = compare_outputs(reference, predict_sample(model))
+    except Exception:
+        logger.exception(f"Could not build the {name} inference engine, using eager mode")
+        classifier.pytorch_model = eager
+        return report
+
+    report.update(parity)
+    if parity["codes_agreement"] < min_agreement or parity["max_ic_diff"] > ic_tolerance:
+        logger.error(f"The {name} inference engine failed the parity check ({parity}), using eager")
+        classifier.pytorch_model = eager
+        return report
+
+    logger.info(f"Using the {name} inference engine ({parity})")
+    report["engine"] = name
+    return report
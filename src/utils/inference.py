@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from api.models.forms import SingleForm
+from utils.metrics import BATCH_FORMS, REQUEST_FORMS, forward_timer, record_stage, stage
+from utils.registry import ModelVersion
+
+
+class Predictions(NamedTuple):
+    """
+    Outputs of a list of forms, with the number of distinct forms and of forms actually
+    run through the model.
+    """
+
+    outputs: list[dict]
+    nb_unique: int
+    nb_scored: int
+
+
+class PredictParams(NamedTuple):
+    """
+    Prediction parameters of a request; requests sharing them can be batched together.
+    """
+
+    nb_echos_max: int
+    prob_min: float
+
+
+def start_inference_pool(concurrency: int) -> ThreadPoolExecutor:
+    """
+    Create the inference thread pool and start all its threads right away.
+
+    Threads are created lazily by `ThreadPoolExecutor`; making them all meet at a
+    barrier forces the pool to be fully started before the first request comes in.
+    """
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="inference")
+    barrier = threading.Barrier(concurrency)
+    list(executor.map(lambda _: barrier.wait(), range(concurrency)))
+    return executor
+
+
+def dataloader_params(nb_forms: int) -> dict:
+    """
+    Choose the DataLoader parameters from the number of forms to score.
+
+    The whole batch goes through the model in chunks of at most DATALOADER_MAX_BATCH_SIZE
+    forms. DataLoader worker processes are forked on every call, so they are only used
+    for batches large enough to amortize it: one worker per DATALOADER_WORKERS_MIN_FORMS
+    forms, up to DATALOADER_MAX_WORKERS (0, the default, never forks).
+    """
+    max_batch_size = int(os.getenv("DATALOADER_MAX_BATCH_SIZE", "256"))
+    max_workers = int(os.getenv("DATALOADER_MAX_WORKERS", "0"))
+    min_forms_per_worker = int(os.getenv("DATALOADER_WORKERS_MIN_FORMS", "4096"))
+
+    return {
+        "pin_memory": False,
+        "persistent_workers": False,
+        "num_workers": min(max_workers, nb_forms // min_forms_per_worker),
+        "batch_size": max(1, min(nb_forms, max_batch_size)),
+    }
+
+
+async def predict_forms(
+    state, forms: list, params: PredictParams, model: ModelVersion
+) -> Predictions:
+    """
+    Predict a list of forms through the prediction cache and the batcher.
+
+    Identical forms (as compared by the prediction cache) are looked up and scored once, and
+    their output is copied back to every position they hold in the list.
+
+    Args:
+        state: The application state holding `prediction_cache` and `batcher`.
+        forms (list): The forms to predict.
+        params (PredictParams): The prediction parameters.
+        model (ModelVersion): The model version to predict with.
+
+    Returns:
+        Predictions: One raw output per form (prediction KV and IC, without MLversion), in
+                     the input order.
+
+    Raises:
+        BatcherOverloadedError: If too many requests are pending.
+    """
+    REQUEST_FORMS.observe(len(forms))
+    model_id = model.model_id
+    cache = state.prediction_cache
+    positions: dict[tuple, list[int]] = {}
+    for idx, form in enumerate(forms):
+        key = cache.key(form, params.nb_echos_max, params.prob_min, model_id)
+        positions.setdefault(key, []).append(idx)
+
+    outputs = [None] * len(forms)
+    missing = []
+    for key, indices in positions.items():
+        out = cache.get(key)
+        if out is None:
+            missing.append(key)
+        for idx in indices:
+            outputs[idx] = out
+
+    if missing:
+        unique_forms = [forms[positions[key][0]] for key in missing]
+        with stage("model"):
+            predicted = await state.batcher.submit(unique_forms, (model, params))
+        for key, out in zip(missing, predicted):
+            out = out.model_dump()
+            cache.set(key, out)
+            for idx in positions[key]:
+                outputs[idx] = out
+
+    return Predictions(outputs, len(positions), len(missing))
+
+
+def predict_batch(model, forms: list, params: PredictParams) -> list:
+    """
+    Run the model on a (possibly merged) list of forms.
+    """
+    params_dict = {
+        "nb_echos_max": params.nb_echos_max,
+        "prob_min": params.prob_min,
+        "dataloader_params": dataloader_params(len(forms)),
+    }
+    return list(model.predict(forms, params=params_dict))
+
+
+def run_batch(forms: list, key: tuple[ModelVersion, PredictParams]) -> list:
+    """
+    Batcher entry point: run the model version of `key` on a merged list of forms, and record
+    the preprocessing and inference durations of the call.
+    """
+    model, params = key
+    BATCH_FORMS.observe(len(forms))
+    start = time.perf_counter()
+    with forward_timer() as forward:
+        outputs = predict_batch(model.model, forms, params)
+    elapsed = time.perf_counter() - start
+
+    if forward["calls"]:
+        record_stage("preprocessing", elapsed - forward["seconds"])
+        record_stage("inference", forward["seconds"])
+    else:
+        record_stage("inference", elapsed)
+    return outputs
+
+
+WARMUP_DESCRIPTIONS = [
+    "boulangerie patisserie",
+    "location meublée de courte durée",
+    "conseil en systèmes et logiciels informatiques",
+    "vente à domicile de produits cosmétiques",
+    "travaux de maçonnerie générale",
+    "exploitation agricole céréales",
+    "coiffure à domicile",
+    "transport de marchandises par route",
+]
+
+
+def synthetic_forms(nb_forms: int) -> list[SingleForm]:
+    return [
+        SingleForm(
+            description_activity=WARMUP_DESCRIPTIONS[idx % len(WARMUP_DESCRIPTIONS)],
+            type_form="X" if idx % 2 else None,
+            nature="01" if idx % 3 else None,
+            surface=12.0 if idx % 4 else None,
+        )
+        for idx in range(nb_forms)
+    ]
+
+
+# Forms from website/exemples/exemple.csv, filling the fields the synthetic forms leave empty:
+# long, upper-case and noisy descriptions, every kind of extra field
+PARITY_FORMS = [
+    {"description_activity": "MACONNERIE GENERALE", "type_form": "M", "nature": "14"},
+    {
+        "description_activity": "TRAITEUR ORGANISATEUR DE RECEPTIONS DIVERSES A DOMICILE OU "
+        "DANS DES LIEUX CHOISIS PAR LE CLIENT",
+        "type_form": "C",
+        "nature": "99",
+        "activity_permanence_status": "P",
+    },
+    {"description_activity": "CONSEIL AUX ENTREPRISES", "type_form": "X", "cj": "5499"},
+    {
+        "description_activity": "NETTOYAGE CHANTIER  RENOVATION  FINITIONS  BRICOLAGE CODE APE "
+        "4339Z",
+        "type_form": "M",
+        "nature": "14",
+        "activity_permanence_status": "S",
+    },
+    {
+        "description_activity": "LOCATION DE LOGEMENT DE TOURISME   CHAMBRE D HOTE  GITE",
+        "type_form": "I",
+        "surface": 85.5,
+    },
+    {
+        "description_activity": "CAMION PIZZA",
+        "other_nature_activity": "vente ambulante",
+        "type_form": "M",
+        "nature": "04",
+    },
+    {
+        "description_activity": "EXPLOITATION AGRICOLE",
+        "precision_act_sec_agricole": "élevage de vaches laitières",
+        "cj": "1000",
+    },
+    {"description_activity": "OPHROLOGUE", "type_form": "L"},
+    {"description_activity": "Développement web et web mobile, webmaster !", "type_form": "X"},
+    {"description_activity": "agent immobilier", "type_form": "R", "surface": 0.0},
+]
+
+
+def parity_forms() -> list[SingleForm]:
+    """
+    Forms checking that an inference engine gives the same outputs as eager mode.
+    """
+    return [SingleForm(**form) for form in PARITY_FORMS] + synthetic_forms(64)
+
+
+def warm_up(model) -> dict[int, float]:
+    """
+    Run synthetic batches of WARMUP_BATCH_SIZES forms through the model, so that lazy
+    initializations (allocators, thread pools, tokenizer and NLTK data...) happen before
+    it serves requests.
+
+    Returns:
+        dict[int, float]: The duration (s) of each warm-up batch, by batch size.
+    """
+    batch_sizes = [int(size) for size in os.getenv("WARMUP_BATCH_SIZES", "1,8,64").split(",")]
+    timings = {}
+    for batch_size in batch_sizes:
+        forms = synthetic_forms(batch_size)
+        start = time.perf_counter()
+        predict_batch(model, forms, PredictParams(5, 0.01))
+        timings[batch_size] = round(time.perf_counter() - start, 4)
+    return timings
@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Awaitable, Callable, Iterator, Optional
+
+import pyarrow.parquet as pq
+
+from utils.batching import BatcherOverloadedError
+from utils.columnar import PARQUET, outputs_to_table, results_schema
+
+logger = logging.getLogger(__name__)
+
+RESULT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "parquet": PARQUET,
+}
+
+
+class JobStorage(ABC):
+    """
+    Storage backend of the bulk prediction jobs.
+
+    A job is made of its metadata, its input forms, the results of each processed chunk
+    and, once done, the exported result files.
+    """
+
+    @abstractmethod
+    def list_jobs(self) -> list[str]: ...
+
+    @abstractmethod
+    def save_meta(self, job_id: str, meta: dict): ...
+
+    @abstractmethod
+    def load_meta(self, job_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    def save_input(self, job_id: str, forms: list[dict]): ...
+
+    @abstractmethod
+    def iter_input(self, job_id: str, start: int, chunk_size: int) -> Iterator[list[dict]]: ...
+
+    @abstractmethod
+    def save_chunk(self, job_id: str, index: int, rows: list[dict]): ...
+
+    @abstractmethod
+    def iter_chunks(self, job_id: str) -> Iterator[list[dict]]: ...
+
+    @abstractmethod
+    def save_results(self, job_id: str, fmt: str, nb_echos_max: int): ...
+
+    @abstractmethod
+    def read_results(self, job_id: str, fmt: str) -> Iterator[bytes]: ...
+
+    @abstractmethod
+    def delete_job(self, job_id: str): ...
+
+
+class LocalJobStorage(JobStorage):
+    """
+    Job storage on the local filesystem: one directory per job under `root`.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, job_id: str, *parts: str) -> str:
+        return os.path.join(self.root, job_id, *parts)
+
+    def list_jobs(self) -> list[str]:
+        return [job_id for job_id in os.listdir(self.root) if os.path.isdir(self._path(job_id))]
+
+    def save_meta(self, job_id: str, meta: dict):
+        os.makedirs(self._path(job_id), exist_ok=True)
+        tmp_path = self._path(job_id, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path(job_id, "meta.json"))
+
+    def load_meta(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(job_id, "meta.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def save_input(self, job_id: str, forms: list[dict]):
+        os.makedirs(self._path(job_id, "chunks"), exist_ok=True)
+        write_ndjson(self._path(job_id, "input.ndjson"), forms)
+
+    def iter_input(self, job_id: str, start: int, chunk_size: int) -> Iterator[list[dict]]:
+        with open(self._path(job_id, "input.ndjson")) as f:
+            lines = islice(f, start, None)
+            while chunk := list(islice(lines, chunk_size)):
+                yield [json.loads(line) for line in chunk]
+
+    def save_chunk(self, job_id: str, index: int, rows: list[dict]):
+        tmp_path = self._path(job_id, "chunks", f"{index:06d}.ndjson.tmp")
+        write_ndjson(tmp_path, rows)
+        os.replace(tmp_path, self._path(job_id, "chunks", f"{index:06d}.ndjson"))
+
+    def _chunk_paths(self, job_id: str) -> list[str]:
+        # Saved chunks only, not the ones being written (.tmp)
+        chunks_dir = self._path(job_id, "chunks")
+        names = sorted(name for name in os.listdir(chunks_dir) if name.endswith(".ndjson"))
+        return [os.path.join(chunks_dir, name) for name in names]
+
+    def iter_chunks(self, job_id: str) -> Iterator[list[dict]]:
+        for chunk_path in self._chunk_paths(job_id):
+            with open(chunk_path) as f:
+                yield [json.loads(line) for line in f]
+
+    def save_results(self, job_id: str, fmt: str, nb_echos_max: int):
+        path = self._path(job_id, f"results.{fmt}")
+        if fmt == "ndjson":
+            with open(path + ".tmp", "wb") as out:
+                for chunk_path in self._chunk_paths(job_id):
+                    with open(chunk_path, "rb") as f:
+                        shutil.copyfileobj(f, out)
+        else:
+            with pq.ParquetWriter(path + ".tmp", results_schema(nb_echos_max)) as writer:
+                for rows in self.iter_chunks(job_id):
+                    writer.write_table(outputs_to_table(rows, nb_echos_max))
+        os.replace(path + ".tmp", path)
+
+    def read_results(self, job_id: str, fmt: str) -> Iterator[bytes]:
+        with open(self._path(job_id, f"results.{fmt}"), "rb") as f:
+            while block := f.read(1 << 20):
+                yield block
+
+    def delete_job(self, job_id: str):
+        shutil.rmtree(self._path(job_id), ignore_errors=True)
+
+
+STORAGE_BACKENDS = {"local": LocalJobStorage}
+
+
+def write_ndjson(path: str, rows: list[dict]):
+    with open(path, "w") as f:
+        f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobManager:
+    """
+    Run bulk prediction jobs in the background, one chunk at a time.
+
+    Each chunk result is persisted before the job progress is updated, so a job interrupted
+    by a restart is resumed from its first unprocessed chunk by `resume`.
+
+    When the API runs several worker processes sharing the storage, only one of them is the
+    `runner`: the others only store the submitted jobs, which the runner picks up by scanning
+    the storage every `poll_interval` seconds.
+
+    Args:
+        storage (JobStorage): Where jobs inputs, progress and results are stored.
+        predict_fn (Callable): Coroutine function called as `predict_fn(forms, params)` and
+                               returning one output per form, `MLversion` included.
+        chunk_size (int): Number of forms processed per chunk.
+        runner (bool): Whether this process runs the jobs.
+        poll_interval (float): Interval (s) between two scans of the storage for pending jobs.
+        retention (float): Time (s) finished (done or failed) jobs are kept after their last
+                           update before the runner deletes them (0 keeps them forever).
+    """
+
+    def __init__(
+        self,
+        storage: JobStorage,
+        predict_fn: Callable[[list[dict], dict], Awaitable[list[dict]]],
+        chunk_size: int = 1024,
+        runner: bool = True,
+        poll_interval: float = 5.0,
+        retention: float = 7 * 24 * 3600,
+    ):
+        self.storage = storage
+        self.predict_fn = predict_fn
+        self.chunk_size = chunk_size
+        self.runner = runner
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._queued: set[str] = set()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not self.runner:
+            return
+        await self.resume()
+        await self.purge()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def resume(self):
+        for job_id in await asyncio.to_thread(self.storage.list_jobs):
+            meta = await asyncio.to_thread(self.storage.load_meta, job_id)
+            if (
+                meta is not None
+                and meta["status"] in ("pending", "running")
+                and job_id not in self._queued
+            ):
+                logger.info(f"Resuming job {job_id} at chunk {meta['chunks_done']}")
+                self._enqueue(job_id)
+
+    async def purge(self):
+        """
+        Delete the finished jobs not updated for `retention` seconds.
+        """
+        if not self.retention:
+            return
+        expired = (datetime.now(timezone.utc) - timedelta(seconds=self.retention)).isoformat()
+        for job_id in await asyncio.to_thread(self.storage.list_jobs):
+            meta = await asyncio.to_thread(self.storage.load_meta, job_id)
+            if (
+                meta is not None
+                and meta["status"] in ("done", "failed")
+                and meta["updated_at"] < expired
+            ):
+                logger.info(f"Deleting job {job_id}, finished at {meta['updated_at']}")
+                await asyncio.to_thread(self.storage.delete_job, job_id)
+
+    def _enqueue(self, job_id: str):
+        self._queued.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    async def submit(self, forms: list[dict], params: dict) -> dict:
+        job_id = uuid.uuid4().hex
+        meta = {
+            "job_id": job_id,
+            "status": "pending",
+            "nb_forms": len(forms),
+            "nb_chunks": -(-len(forms) // self.chunk_size),
+            "chunks_done": 0,
+            "chunk_size": self.chunk_size,
+            "params": params,
+            "created_at": now(),
+            "updated_at": now(),
+            "error": None,
+        }
+        await asyncio.to_thread(self.storage.save_input, job_id, forms)
+        await asyncio.to_thread(self.storage.save_meta, job_id, meta)
+        if self.runner:
+            self._enqueue(job_id)
+        return meta
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.storage.load_meta(job_id)
+
+    async def _run(self):
+        while True:
+            try:
+                job_id = await asyncio.wait_for(self._queue.get(), self.poll_interval)
+            except asyncio.TimeoutError:
+                # Jobs submitted to other worker processes
+                try:
+                    await self.resume()
+                    await self.purge()
+                except Exception:
+                    logger.exception("Could not scan the job storage")
+                continue
+
+            # A storage error fails the job but never stops the runner
+            meta = None
+            try:
+                meta = await asyncio.to_thread(self.storage.load_meta, job_id)
+                if meta is None:
+                    logger.warning(f"Job {job_id} has no metadata anymore, skipping it")
+                    continue
+                await self._process(meta)
+            except Exception as e:
+                logger.exception(f"Job {job_id} failed")
+                if meta is not None:
+                    meta.update(status="failed", error=str(e), updated_at=now())
+                    try:
+                        await asyncio.to_thread(self.storage.save_meta, job_id, meta)
+                    except Exception:
+                        logger.exception(f"Could not save the failure of job {job_id}")
+            finally:
+                self._queued.discard(job_id)
+
+    async def _process(self, meta: dict):
+        job_id = meta["job_id"]
+        meta.update(status="running", updated_at=now())
+        await asyncio.to_thread(self.storage.save_meta, job_id, meta)
+
+        chunk_size = meta["chunk_size"]
+        chunks = self.storage.iter_input(job_id, meta["chunks_done"] * chunk_size, chunk_size)
+        while (forms := await asyncio.to_thread(next, chunks, None)) is not None:
+            while True:
+                try:
+                    outputs = await self.predict_fn(forms, meta["params"])
+                    break
+                except BatcherOverloadedError:
+                    # Jobs are background work: let interactive requests go first
+                    await asyncio.sleep(1)
+
+            await asyncio.to_thread(self.storage.save_chunk, job_id, meta["chunks_done"], outputs)
+            meta.update(chunks_done=meta["chunks_done"] + 1, updated_at=now())
+            await asyncio.to_thread(self.storage.save_meta, job_id, meta)
+
+        for fmt in RESULT_FORMATS:
+            await asyncio.to_thread(
+                self.storage.save_results, job_id, fmt, meta["params"]["nb_echos_max"]
+            )
+        meta.update(status="done", updated_at=now())
+        await asyncio.to_thread(self.storage.save_meta, job_id, meta)
@@ -1,24 +1,96 @@
+import logging
 import os
+from typing import Any, Optional
 
 import mlflow
 import nltk
 
+from utils.artifact_cache import ArtifactCache
+from utils.classifier import find_classifier
+from utils.engines import apply_engine
+from utils.inference import PredictParams, parity_forms, predict_batch
+from utils.metrics import instrument_forward
 
-def load_model():
+logger = logging.getLogger(__name__)
+
+
+# Models loaded by the parent process before forking the API workers (see api.serve)
+PRELOADED_MODELS: dict[str, Any] = {}
+
+
+def load_model(version: Optional[str] = None):
     # mlflow.set_tracking_uri(os.environ["MLFLOW_TRACKING_URI"])
-    model_uri = f"models:/{os.environ['MLFLOW_MODEL_NAME']}/{os.environ['MLFLOW_MODEL_VERSION']}"
+    name = os.environ["MLFLOW_MODEL_NAME"]
+    version = version or os.environ["MLFLOW_MODEL_VERSION"]
+    if version in PRELOADED_MODELS:
+        logger.info(f"Using the preloaded model {name}/{version}")
+        return PRELOADED_MODELS[version]
+    model_uri = f"models:/{name}/{version}"
 
-    # Step 1: Set the destination path for the model artifacts
-    dst_path = "/tmp/my_model/artifacts/pyfunc_model"
+    # Step 1: Find the artifacts in the local cache, or download them into it
+    cache = ArtifactCache(
+        os.getenv("MODEL_CACHE_DIR", "/tmp/codif-ape-models"),
+        keep_versions=int(os.getenv("MODEL_CACHE_KEEP_VERSIONS", "2")),
+        verify=os.getenv("MODEL_CACHE_VERIFY", "True") == "True",
+    )
 
-    # Step 2: Download/extract the model here *without loading it yet*
-    mlflow.artifacts.download_artifacts(artifact_uri=model_uri, dst_path=dst_path)
+    if os.getenv("MODEL_CACHE_OFFLINE") == "True":
+        # Offline mode: the registry is never contacted
+        dst_path = cache.get(name, version)
+        if dst_path is None:
+            raise RuntimeError(f"Offline mode but {name}/{version} is not in the model cache")
+    else:
+        try:
+            source = mlflow.MlflowClient().get_model_version(name, version).source
+        except Exception:
+            logger.exception("Could not reach the model registry, trying the model cache")
+            source = None
+            dst_path = cache.get(name, version)
+            if dst_path is None:
+                raise
+        else:
+            dst_path = cache.get(name, version, source) or cache.put(
+                name,
+                version,
+                lambda path: mlflow.artifacts.download_artifacts(
+                    artifact_uri=model_uri, dst_path=path
+                ),
+                source,
+            )
+    logger.info(f"Model artifacts of {name}/{version} at {dst_path}")
 
-    # Step 3: Append the nltk_data/ folder to nltk path BEFORE loading the model
+    # Step 2: Append the nltk_data/ folder to nltk path BEFORE loading the model
     nltk_data_path = os.path.join(dst_path, "artifacts", "nltk_data")
-    nltk.data.path.append(nltk_data_path)
+    if nltk_data_path not in nltk.data.path:
+        nltk.data.path.append(nltk_data_path)
 
-    # Step 4: Now safely load the model from the pre-downloaded path
+    # Step 3: Now safely load the model from the pre-downloaded path
     model = mlflow.pyfunc.load_model(dst_path)
 
+    def predict_sample(m) -> list[dict]:
+        outputs = predict_batch(m, parity_forms(), PredictParams(5, 0))
+        return [out.model_dump() for out in outputs]
+
+    # Step 4: Switch the forward pass to the configured engine, if it gives the same outputs
+    apply_engine(
+        model,
+        os.getenv("INFERENCE_ENGINE", "eager"),
+        predict_sample=predict_sample,
+        min_agreement=float(os.getenv("INFERENCE_ENGINE_MIN_AGREEMENT", "0.99")),
+        ic_tolerance=float(os.getenv("INFERENCE_ENGINE_IC_TOLERANCE", "0.05")),
+    )
+
+    # Forward passes are timed apart from the rest of the artifact predict (see utils.metrics)
+    classifier = find_classifier(model)
+    if classifier is not None:
+        instrument_forward(classifier.pytorch_model)
+
     return model
+
+
+def resolve_alias(alias: str) -> str:
+    """
+    Return the version of MLFLOW_MODEL_NAME the registry alias currently points to.
+    """
+    name = os.environ["MLFLOW_MODEL_NAME"]
+    return mlflow.MlflowClient().get_model_version_by_alias(name, alias).version
@@ -1,7 +1,5 @@
 import logging
 
-from api.models.responses import OutputResponse
-
 
 def configure_logging():
     logging.basicConfig(
@@ -12,8 +10,3 @@ def configure_logging():
         ],
     )
     logging.getLogger("mlflow").setLevel(logging.ERROR)
-
-
-def log_prediction(query: dict, response: OutputResponse, index: int = 0):
-    query_line = {key: value[index] for key, value in query.items()}
-    logging.info(f"{{'Query': {query_line}, 'Response': {response.model_dump()}}}")
@@ -0,0 +1,416 @@
+"""
+Prometheus metrics of the API, in the text exposition format.
+
+Metrics are plain in-process counters updated under a lock (a few microseconds per request),
+so they stay on in production. With several API workers (see `api.serve`), each worker writes
+a snapshot of its metrics to METRICS_DIR every few seconds and `/metrics` merges the
+snapshots of all workers, so whichever worker answers the scrape reports the whole server.
+
+Request latencies are split by stage:
+
+- parsing: receiving and JSON decoding the body
+- validation: BatchForms validation
+- model: time a request waits for its forms to be scored (queueing and merged model call)
+- preprocessing: per model call, everything in the artifact `predict` outside the forward
+  pass (cleaning, tokenization, top-k decoding)
+- inference: per model call, the forward pass of the network
+- response: building the OutputResponse rows
+- serialization: writing the response body
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)  # fmt: skip
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+
+
+class Metric:
+    """
+    A metric family: one value per combination of label values.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): HELP text.
+        labels (tuple): Label names.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def values(self) -> dict[tuple, object]:
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def merge(values: list) -> object:
+        return sum(values)
+
+    def samples(self, key: tuple, value) -> list[tuple[str, dict, float]]:
+        return [(self.name, dict(zip(self.labels, key)), value)]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Gauge set by the code, or read at collection time from `collect`, a callable returning
+    the values by label values. Gauges of several workers are summed, or their maximum is
+    kept with `merge_max`.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        collect: Optional[Callable[[], dict[tuple, float]]] = None,
+        merge_max: bool = False,
+    ):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+        self.merge_max = merge_max
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def values(self) -> dict[tuple, object]:
+        if self.collect is not None:
+            return dict(self.collect())
+        return super().values()
+
+    def merge(self, values: list) -> object:
+        return max(values) if self.merge_max else sum(values)
+
+
+class Histogram(Metric):
+    """
+    Histogram of observations; its value is the count per bucket (non cumulative, the last
+    one for +Inf) followed by the sum of the observations.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount: float, *label_values):
+        idx = bisect.bisect_left(self.buckets, amount)
+        with self._lock:
+            value = self._values.get(label_values)
+            if value is None:
+                value = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            value[idx] += 1
+            value[-1] += amount
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+    @staticmethod
+    def merge(values: list) -> object:
+        return [sum(column) for column in zip(*values)]
+
+    def samples(self, key: tuple, value) -> list[tuple[str, dict, float]]:
+        labels = dict(zip(self.labels, key))
+        samples = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), value[:-1]):
+            cumulative += count
+            samples.append((f"{self.name}_bucket", {**labels, "le": str(bound)}, cumulative))
+        samples.append((f"{self.name}_count", labels, cumulative))
+        samples.append((f"{self.name}_sum", labels, value[-1]))
+        return samples
+
+
+def format_sample(name: str, labels: dict, value: float) -> str:
+    if labels:
+        pairs = ",".join(
+            '{}="{}"'.format(
+                key, str(val).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+            )
+            for key, val in labels.items()
+        )
+        name = f"{name}{{{pairs}}}"
+    return f"{name} {float(value)!r}"
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process, and the snapshots of the other workers in `directory`.
+
+    Counters and histograms of exited workers are still merged, so that totals never go
+    down; their gauges are dropped.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict:
+        return {
+            metric.name: [[list(key), value] for key, value in metric.values().items()]
+            for metric in self.metrics
+        }
+
+    def write_snapshot(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def other_snapshots(self) -> list[tuple[dict, bool]]:
+        """
+        Return the snapshots of the other workers, with whether each worker is alive.
+        """
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            pid, ext = os.path.splitext(filename)
+            if ext != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshots.append((json.load(f), process_alive(int(pid))))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        others = self.other_snapshots()
+        lines = []
+        for metric in self.metrics:
+            merged: dict[tuple, list] = {}
+            for key, value in metric.values().items():
+                merged.setdefault(key, []).append(value)
+            for snapshot, alive in others:
+                if metric.type == "gauge" and not alive:
+                    continue
+                for key, value in snapshot.get(metric.name, []):
+                    merged.setdefault(tuple(key), []).append(value)
+
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for key, values in sorted(merged.items()):
+                for sample in metric.samples(key, metric.merge(values)):
+                    lines.append(format_sample(*sample))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.register(
+    Counter("codif_ape_requests_total", "HTTP requests", ("method", "route", "status"))
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram("codif_ape_request_duration_seconds", "HTTP request latency", ("route",))
+)
+IN_FLIGHT = REGISTRY.register(
+    Gauge("codif_ape_requests_in_flight", "HTTP requests being processed")
+)
+STAGE_SECONDS = REGISTRY.register(
+    Histogram("codif_ape_stage_duration_seconds", "Latency of each processing stage", ("stage",))
+)
+REQUEST_FORMS = REGISTRY.register(
+    Histogram("codif_ape_request_forms", "Forms per prediction request", buckets=SIZE_BUCKETS)
+)
+BATCH_FORMS = REGISTRY.register(
+    Histogram("codif_ape_batch_forms", "Forms per model call", buckets=SIZE_BUCKETS)
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge("codif_ape_queue_depth", "Prediction requests waiting for the batcher")
+)
+PREDICTION_LOGS = REGISTRY.register(
+    Counter(
+        "codif_ape_prediction_log_events_total",
+        "Prediction events by outcome (logged, dropped or failed)",
+        ("outcome",),
+    )
+)
+PREDICTION_LOG_PENDING = REGISTRY.register(
+    Gauge("codif_ape_prediction_log_pending", "Prediction events waiting to be written")
+)
+MODEL_INFO = REGISTRY.register(
+    Gauge("codif_ape_model_info", "Current model version", ("model_id",), merge_max=True)
+)
+
+
+class RequestTimings:
+    """
+    Stage durations (s) of the current request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _request_timings.get()
+
+
+def record_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.stages[name] = timings.stages.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time the enclosed block as the stage `name` of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def mark_parsed():
+    """
+    Record the parsing stage: from the start of the request to now. Called once the body
+    is decoded, before it is validated.
+    """
+    timings = _request_timings.get()
+    if timings is not None and "parsing" not in timings.stages:
+        record_stage("parsing", time.perf_counter() - timings.start)
+
+
+_forward = threading.local()
+
+
+def instrument_forward(module):
+    """
+    Time the forward passes of a torch module, see `forward_timer`.
+    """
+
+    def before(*_):
+        _forward.start = time.perf_counter()
+
+    def after(*_):
+        _forward.seconds = getattr(_forward, "seconds", 0.0) + time.perf_counter() - _forward.start
+        _forward.calls = getattr(_forward, "calls", 0) + 1
+
+    module.register_forward_pre_hook(before)
+    module.register_forward_hook(after)
+
+
+@contextmanager
+def forward_timer():
+    """
+    Collect the duration of the instrumented forward passes run by this thread in the block.
+
+    Yields:
+        dict: Filled on exit with `seconds` and `calls` (0 if the module is not instrumented).
+    """
+    _forward.seconds = 0.0
+    _forward.calls = 0
+    result = {}
+    try:
+        yield result
+    finally:
+        result.update(seconds=_forward.seconds, calls=_forward.calls)
+
+
+def server_timing(timings: RequestTimings) -> str:
+    """
+    Format the stage timings of a request, and its duration so far, as a Server-Timing header.
+    """
+    durations = {**timings.stages, "total": time.perf_counter() - timings.start}
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in durations.items())
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and in-flight requests, timing them, and exposing the
+    stage timings of the current request through `current_timings()`.
+
+    The stages run before the response starts are also returned to the caller in a
+    Server-Timing header (in ms), unless `server_timing` is False.
+    """
+
+    def __init__(self, app, server_timing: bool = True):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = server_timing(timings).encode("latin-1")
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", header)]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec()
+            _request_timings.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUESTS.inc(scope["method"], route, str(status))
+            REQUEST_SECONDS.observe(time.perf_counter() - timings.start, route)
@@ -0,0 +1,364 @@
+"""
+Asynchronous logging of prediction events.
+
+Endpoints hand their forms and responses to a PredictionLogger, which only samples them and
+queues them: turning them into events (one per form) and writing them happens in a background
+thread, in batches. The queue is bounded, events that do not fit are dropped and counted, so a
+slow sink never adds latency to the requests.
+
+An event is a JSON object with the same nesting as the former text logs, so that flattening it
+gives the columns of the dashboard:
+
+    {"Timestamp": "2025-01-31 12:00:00.000", "Query": {<SingleForm fields>},
+     "Response": {"1": {"code": ..., "probabilite": ..., "libelle": ...}, ..., "IC": ...,
+                  "MLversion": ...}}
+
+Events are written as JSON lines (JsonLinesSink) or straight into the date-partitioned
+Parquet dataset of the dashboard (ParquetSink). Prediction logging is off unless a sink is
+chosen with PREDICTION_LOG_SINK.
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.columnar import flatten_event, prediction_log_schema
+from utils.metrics import PREDICTION_LOGS
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+class PredictionLogSink(ABC):
+    """
+    Destination of the prediction events, written in batches from the logger thread.
+    """
+
+    @abstractmethod
+    def write(self, events: list[dict]): ...
+
+    def flush(self):
+        """
+        Called regularly by the logger thread, to write data the sink has buffered for too long.
+        """
+
+    def close(self):
+        self.flush()
+
+
+class JsonLinesSink(PredictionLogSink):
+    """
+    Append events as JSON lines to a file, or to the standard output with path "-".
+
+    Each batch is written with a single `write` call on a file opened in append mode, so that
+    the lines of several API workers sharing the file are never interleaved.
+    """
+
+    def __init__(self, path: str = "-"):
+        self.path = path
+        if path == "-":
+            self.fd = sys.stdout.fileno()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, events: list[dict]):
+        data = "".join(
+            json.dumps(
+                {**event, "Timestamp": event["Timestamp"].strftime(TIMESTAMP_FORMAT)[:-3]},
+                ensure_ascii=False,
+            )
+            + "\n"
+            for event in events
+        )
+        view = memoryview(data.encode())
+        while view:
+            view = view[os.write(self.fd, view) :]
+
+    def close(self):
+        if self.path != "-":
+            os.close(self.fd)
+
+
+@dataclass
+class ParquetFile:
+    writer: pq.ParquetWriter
+    tmp_path: str
+    path: str
+    opened_at: float
+    rows: int = 0
+
+
+class ParquetSink(PredictionLogSink):
+    """
+    Write events into a date-partitioned Parquet dataset (`<path>/date=YYYY-MM-DD/*.parquet`)
+    with the schema of the dashboard (see `prediction_log_schema`).
+
+    Events are buffered as Arrow record batches and written as a row group once
+    `row_group_size` events are buffered or the oldest one is `max_buffer_age` seconds old.
+    A file is finalized once it holds `max_file_rows` events or is `max_file_age` seconds old,
+    when the day changes and when the sink is closed. Files being written are hidden (their
+    name starts with a dot, skipped by Parquet dataset readers) until they are finalized.
+
+    Args:
+        path (str): Root directory of the dataset.
+        nb_echos_max (int): Number of predictions per event kept in the dataset.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        nb_echos_max: int = 5,
+        row_group_size: int = 10000,
+        max_buffer_age: float = 60,
+        max_file_rows: int = 1000000,
+        max_file_age: float = 3600,
+    ):
+        self.path = path
+        self.schema = prediction_log_schema(nb_echos_max)
+        self.row_group_size = row_group_size
+        self.max_buffer_age = max_buffer_age
+        self.max_file_rows = max_file_rows
+        self.max_file_age = max_file_age
+        self._buffers: dict[str, list[pa.RecordBatch]] = {}
+        self._buffered_rows = 0
+        self._buffered_since: Optional[float] = None
+        self._files: dict[str, ParquetFile] = {}
+
+    def write(self, events: list[dict]):
+        rows_by_date: dict[str, list[dict]] = {}
+        for event in events:
+            date = event["Timestamp"].strftime("%Y-%m-%d")
+            rows_by_date.setdefault(date, []).append(flatten_event(event))
+        for date, rows in rows_by_date.items():
+            batch = pa.RecordBatch.from_pylist(rows, schema=self.schema)
+            self._buffers.setdefault(date, []).append(batch)
+
+        self._buffered_rows += len(events)
+        self._buffered_since = self._buffered_since or time.monotonic()
+        if self._buffered_rows >= self.row_group_size:
+            self._write_buffers()
+        self._finalize_files()
+
+    def flush(self):
+        if (
+            self._buffered_since is not None
+            and time.monotonic() - self._buffered_since >= self.max_buffer_age
+        ):
+            self._write_buffers()
+        self._finalize_files()
+
+    def close(self):
+        self._write_buffers()
+        self._finalize_files(force=True)
+
+    def _write_buffers(self):
+        for date, batches in self._buffers.items():
+            file = self._files.get(date) or self._open(date)
+            file.writer.write_table(pa.Table.from_batches(batches, schema=self.schema))
+            file.rows += sum(batch.num_rows for batch in batches)
+        self._buffers.clear()
+        self._buffered_rows = 0
+        self._buffered_since = None
+
+    def _open(self, date: str) -> ParquetFile:
+        directory = os.path.join(self.path, f"date={date}")
+        os.makedirs(directory, exist_ok=True)
+        name = f"part-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}-{uuid.uuid4().hex[:8]}.parquet"
+        tmp_path = os.path.join(directory, f".{name}")
+        file = ParquetFile(
+            writer=pq.ParquetWriter(tmp_path, self.schema),
+            tmp_path=tmp_path,
+            path=os.path.join(directory, name),
+            opened_at=time.monotonic(),
+        )
+        self._files[date] = file
+        return file
+
+    def _finalize_files(self, force: bool = False):
+        today = datetime.now().strftime("%Y-%m-%d")
+        for date, file in list(self._files.items()):
+            if (
+                force
+                or date != today
+                or file.rows >= self.max_file_rows
+                or time.monotonic() - file.opened_at >= self.max_file_age
+            ):
+                file.writer.close()
+                os.replace(file.tmp_path, file.path)
+                del self._files[date]
+
+
+LOG_SINKS = {
+    "jsonl": JsonLinesSink,
+    "parquet": ParquetSink,
+}
+
+
+class PredictionLogger:
+    """
+    Sample prediction events and write them to a sink from a background thread.
+
+    Args:
+        sink (PredictionLogSink): Where the events are written.
+        sample_rate (float): Share of the forms whose event is logged (1 logs everything).
+        max_pending (int): Maximum number of events waiting to be written; events of requests
+                           that would exceed it are dropped.
+        batch_size (int): Maximum number of events per write.
+        flush_interval (float): Maximum time (s) an event waits before being written.
+    """
+
+    def __init__(
+        self,
+        sink: PredictionLogSink,
+        sample_rate: float = 1.0,
+        max_pending: int = 100000,
+        batch_size: int = 1000,
+        flush_interval: float = 1.0,
+    ):
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.counts = {"logged": 0, "dropped": 0, "failed": 0}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Write the queued events, then close the sink.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+        self.sink.close()
+
+    def log(self, forms: list, responses: list[dict]):
+        """
+        Queue the events of a request, without blocking.
+
+        Args:
+            forms (list): The SingleForm of the request.
+            responses (list[dict]): The OutputResponse rows, in the same order.
+        """
+        if self.sample_rate < 1:
+            kept = [idx for idx in range(len(forms)) if random.random() < self.sample_rate]
+            forms = [forms[idx] for idx in kept]
+            responses = [responses[idx] for idx in kept]
+        if not forms:
+            return
+
+        with self._lock:
+            if self._pending + len(forms) > self.max_pending:
+                self.counts["dropped"] += len(forms)
+                PREDICTION_LOGS.inc("dropped", amount=len(forms))
+                return
+            self._pending += len(forms)
+        self._queue.put((datetime.now(), forms, responses))
+
+    def _run(self):
+        events = []
+        deadline = None
+        while True:
+            # Wake up at least every flush_interval, so that idle sinks get flushed too
+            timeout = self.flush_interval if deadline is None else deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=max(0.0, timeout))
+            except queue.Empty:
+                item = ()
+
+            if item:
+                timestamp, forms, responses = item
+                events.extend(
+                    {"Timestamp": timestamp, "Query": form.model_dump(), "Response": response}
+                    for form, response in zip(forms, responses)
+                )
+                deadline = deadline or time.monotonic() + self.flush_interval
+                if len(events) < self.batch_size:
+                    continue
+
+            # Batch full, flush interval elapsed or logger stopping (None)
+            if events:
+                self._write(events)
+                events = []
+                deadline = None
+            if not item:
+                self._flush()
+            if item is None:
+                return
+
+    def _write(self, events: list[dict]):
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start : start + self.batch_size]
+            outcome = "logged"
+            try:
+                self.sink.write(batch)
+            except Exception:
+                logger.exception(f"Could not write {len(batch)} prediction events")
+                outcome = "failed"
+            with self._lock:
+                self._pending -= len(batch)
+                self.counts[outcome] += len(batch)
+            PREDICTION_LOGS.inc(outcome, amount=len(batch))
+
+    def _flush(self):
+        try:
+            self.sink.flush()
+        except Exception:
+            logger.exception("Could not flush the prediction log sink")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "pending": self._pending, "sample_rate": self.sample_rate}
+
+
+def create_prediction_logger() -> Optional[PredictionLogger]:
+    """
+    Create the prediction logger configured by the PREDICTION_LOG_* environment variables,
+    None if prediction logging is disabled.
+    """
+    sink_name = os.getenv("PREDICTION_LOG_SINK", "none")
+    if sink_name == "none":
+        return None
+    path = os.getenv("PREDICTION_LOG_PATH", "-")
+    if sink_name == "parquet":
+        sink = ParquetSink(
+            path,
+            nb_echos_max=int(os.getenv("PREDICTION_LOG_NB_ECHOS", "5")),
+            row_group_size=int(os.getenv("PREDICTION_LOG_ROW_GROUP_SIZE", "10000")),
+            max_buffer_age=float(os.getenv("PREDICTION_LOG_MAX_BUFFER_AGE", "60")),
+            max_file_rows=int(os.getenv("PREDICTION_LOG_MAX_FILE_ROWS", "1000000")),
+            max_file_age=float(os.getenv("PREDICTION_LOG_MAX_FILE_AGE", "3600")),
+        )
+    else:
+        sink = LOG_SINKS[sink_name](path)
+    return PredictionLogger(
+        sink,
+        sample_rate=float(os.getenv("PREDICTION_LOG_SAMPLE_RATE", "1")),
+        max_pending=int(os.getenv("PREDICTION_LOG_MAX_PENDING", "100000")),
+        batch_size=int(os.getenv("PREDICTION_LOG_BATCH_SIZE", "1000")),
+        flush_interval=float(os.getenv("PREDICTION_LOG_FLUSH_INTERVAL", "1")),
+    )
@@ -0,0 +1,202 @@
+"""
+Opt-in sampling profiler of single requests.
+
+A request sent with admin credentials and the `X-Profile: true` header runs under a sampling
+profiler: the stacks of all the threads of the worker (event loop and inference threads) are
+sampled every PROFILE_INTERVAL_MS while the request is processed. The profile is stored in
+PROFILES_DIR in the folded stacks format read by flamegraph.pl and speedscope, and its id is
+returned in the X-Profile-Id response header (see `GET /admin/profiles/{profile_id}`).
+
+The samples cover every thread of the worker, so concurrent requests show up in the profile.
+"""
+
+import base64
+import binascii
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+
+from utils.security import is_admin
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """
+    Sample the stacks of every other thread of the process at a fixed interval.
+
+    Args:
+        interval (float): Seconds between two samples.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class ProfileStore:
+    """
+    Directory of the request profiles, keeping the `keep` most recent ones.
+    """
+
+    def __init__(self, directory: str, keep: int = 100):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, profile_id: str, folded: str, meta: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, profile_id)
+        with open(f"{path}.folded", "w") as f:
+            f.write(folded)
+        with open(f"{path}.json", "w") as f:
+            json.dump(meta, f)
+
+        profiles = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in profiles[: max(0, len(profiles) - self.keep)]:
+            for ext in (".json", ".folded"):
+                try:
+                    os.remove(entry.path.removesuffix(".json") + ext)
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> list[dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return sorted(profiles, key=lambda meta: meta["started_at"], reverse=True)
+
+    def load(self, profile_id: str) -> Optional[str]:
+        try:
+            uuid.UUID(hex=profile_id)
+            with open(os.path.join(self.directory, f"{profile_id}.folded")) as f:
+                return f.read()
+        except (ValueError, OSError):
+            return None
+
+
+def basic_credentials(headers: dict[bytes, bytes]) -> Optional[tuple[str, str]]:
+    scheme, _, encoded = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "basic":
+        return None
+    try:
+        username, sep, password = base64.b64decode(encoded).decode().partition(":")
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return (username, password) if sep else None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests sent with the `X-Profile: true` header.
+
+    Requests asking for a profile without valid admin credentials are rejected with 403.
+    """
+
+    def __init__(self, app, store: ProfileStore, interval: float = 0.005):
+        self.app = app
+        self.store = store
+        self.interval = interval
+        # One profiled request at a time: samples cover the whole process
+        self._lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile", b"").lower() not in (b"true", b"1"):
+            await self.app(scope, receive, send)
+            return
+
+        credentials = basic_credentials(headers)
+        if credentials is None or not is_admin(*credentials):
+            await send_json(send, 403, {"detail": "Profiling requires admin credentials"})
+            return
+        if not self._lock.acquire(blocking=False):
+            await send_json(send, 409, {"detail": "Another request is being profiled"})
+            return
+
+        profile_id = uuid.uuid4().hex
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                header = (b"x-profile-id", profile_id.encode())
+                message["headers"] = [*message.get("headers", []), header]
+            await send(message)
+
+        profiler = SamplingProfiler(self.interval)
+        started_at = time.time()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            self._lock.release()
+            meta = {
+                "profile_id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "started_at": started_at,
+                "duration": time.time() - started_at,
+                "samples": profiler.samples.total(),
+                "interval": self.interval,
+                "pid": os.getpid(),
+            }
+            self.store.save(profile_id, profiler.folded(), meta)
+            logger.info(f"Request profile {profile_id} stored ({meta['samples']} samples)")
+
+
+async def send_json(send, status: int, content: dict):
+    body = json.dumps(content).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
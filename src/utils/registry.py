@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ModelNotReadyError(Exception):
+    """
+    Raised when no model version has been loaded and warmed up yet.
+    """
+
+
+class ModelVersionNotFoundError(KeyError):
+    """
+    Raised when a requested model version is not resident in the registry.
+    """
+
+
+@dataclass(eq=False)
+class ModelVersion:
+    """
+    A model version resident in memory. Instances are compared by identity, so that they
+    can be part of a batcher key.
+    """
+
+    version: str
+    model: Any = field(repr=False)
+    model_id: str
+    load_seconds: float = 0.0
+    warmup_seconds: dict[int, float] = field(default_factory=dict)
+    loaded_at: float = field(default_factory=time.time)
+    retired_at: Optional[float] = None
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "model_id": self.model_id,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "loaded_at": self.loaded_at,
+            "retired_at": self.retired_at,
+        }
+
+
+class ModelRegistry:
+    """
+    Model versions resident in the API, one of them being the current one.
+
+    A new version is loaded and warmed up next to the current one, which keeps serving
+    requests in the meantime, then becomes current in a single assignment. Previous versions
+    stay resident for `retention_seconds` so that requests can still pin them, within
+    `max_versions` resident versions (the oldest retired ones are evicted first).
+
+    Args:
+        loader (Callable): Function called as `loader(version)` and returning the model.
+        warmup (Callable): Function called as `warmup(model)` before a version becomes current,
+                           returning the warm-up duration per batch size.
+        retention_seconds (float): How long a retired version stays resident.
+        max_versions (int): Maximum number of resident versions, at least 2 (the current one
+                            and the one being loaded). It counts models, not bytes: size it
+                            from the memory limit divided by the memory taken by one model.
+        on_swap (Callable, optional): Called with the new current ModelVersion after a swap.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Any],
+        warmup: Callable[[Any], dict[int, float]],
+        retention_seconds: float = 3600,
+        max_versions: int = 2,
+        on_swap: Optional[Callable[[ModelVersion], None]] = None,
+    ):
+        self.loader = loader
+        self.warmup = warmup
+        self.retention = retention_seconds
+        self.max_versions = max(2, max_versions)
+        self.on_swap = on_swap
+        self.versions: dict[str, ModelVersion] = {}
+        self.current: Optional[ModelVersion] = None
+        self._lock = asyncio.Lock()
+
+    def get(self, version: Optional[str] = None) -> ModelVersion:
+        """
+        Return a resident version, the current one by default.
+
+        Raises:
+            ModelNotReadyError: If no version is loaded yet.
+            ModelVersionNotFoundError: If the version is not resident.
+        """
+        if self.current is None:
+            raise ModelNotReadyError("The model is still loading")
+        if version is None or version == self.current.version:
+            return self.current
+        self.prune()
+        try:
+            return self.versions[version]
+        except KeyError:
+            raise ModelVersionNotFoundError(
+                f"Model version {version} is not loaded, available: {sorted(self.versions)}"
+            )
+
+    def describe(self) -> dict:
+        self.prune()
+        return {
+            "current": self.current.version if self.current else None,
+            "max_versions": self.max_versions,
+            "retention_seconds": self.retention,
+            "versions": [entry.describe() for entry in self.versions.values()],
+        }
+
+    def prune(self):
+        """
+        Evict the retired versions whose retention period is over.
+        """
+        now = time.time()
+        for version, entry in list(self.versions.items()):
+            if entry.retired_at is not None and now - entry.retired_at > self.retention:
+                logger.info(f"Evicting model version {version} (retention period over)")
+                del self.versions[version]
+
+    def _make_room(self):
+        self.prune()
+        retired = sorted(
+            (entry for entry in self.versions.values() if entry is not self.current),
+            key=lambda entry: entry.retired_at or 0.0,
+        )
+        while len(self.versions) >= self.max_versions and retired:
+            entry = retired.pop(0)
+            logger.info(f"Evicting model version {entry.version} (max resident versions)")
+            del self.versions[entry.version]
+
+    async def load(self, version: str) -> ModelVersion:
+        """
+        Load and warm up a version, then make it the current one.
+
+        A version already resident is made current again without being reloaded.
+        """
+        async with self._lock:
+            entry = self.versions.get(version)
+            if entry is None:
+                self._make_room()
+                logger.info(f"Loading model version {version}")
+                start = time.perf_counter()
+                model = await asyncio.to_thread(self.loader, version)
+                load_seconds = time.perf_counter() - start
+                warmup_seconds = await asyncio.to_thread(self.warmup, model)
+                entry = ModelVersion(
+                    version=version,
+                    model=model,
+                    model_id=model.metadata.model_id,
+                    load_seconds=load_seconds,
+                    warmup_seconds=warmup_seconds,
+                )
+                self.versions[version] = entry
+
+            if entry is not self.current:
+                previous, entry.retired_at = self.current, None
+                self.current = entry
+                if previous is not None:
+                    previous.retired_at = time.time()
+                logger.info(f"Model version {version} ({entry.model_id}) is now current")
+                if self.on_swap is not None:
+                    self.on_swap(entry)
+            return entry
+
+    async def watch(self, resolve: Callable[[], str], interval: float):
+        """
+        Periodically resolve the version to serve (e.g. from a registry alias) and load it
+        when it changes.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                version = await asyncio.to_thread(resolve)
+                if version != self.current.version:
+                    await self.load(version)
+                self.prune()
+            except Exception:
+                logger.exception("Model watcher failed, keeping the current version")
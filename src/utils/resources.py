@@ -0,0 +1,148 @@
+"""
+CPU and memory aware defaults for the serving settings.
+
+In a container, `os.cpu_count()` (used by torch, DataLoader and uvicorn) is the host core
+count, not the CPU quota of the pod. The limits are read from the cgroup instead (v2, then
+v1) and the thread, worker and batch size settings are derived from them, unless they are
+set explicitly through their environment variable.
+"""
+
+import logging
+import math
+import os
+from typing import Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Sizing figures of the derived settings. They are not measured on the served model: they are
+# deliberately generous starting points (a worker per GB, and DataLoader batches kept at 256
+# forms down to 4 GB per worker). Measure them with benchmarks/memory.py on the served model
+# and set them through WORKER_MEMORY_MB, FORM_MEMORY_MB and CPUS_PER_MODEL_CALL.
+# Resident memory of an API worker on top of the shared model weights (MB)
+WORKER_MEMORY_MB = 1024
+# Peak memory per form of a DataLoader batch: tokens, embeddings and activations (MB)
+FORM_MEMORY_MB = 16
+# CPUs per model call in flight (torch threads of a call) and per API worker
+CPUS_PER_MODEL_CALL = 4
+
+
+def read_first_line(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_quota() -> Optional[float]:
+    """
+    Return the CPU quota of the cgroup, in CPUs, or None if unlimited.
+    """
+    cpu_max = read_first_line("/sys/fs/cgroup/cpu.max")
+    if cpu_max is not None:
+        quota, _, period = cpu_max.partition(" ")
+        return None if quota == "max" else int(quota) / int(period or 100000)
+
+    quota = read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return int(quota) / int(period)
+
+
+def cgroup_memory_limit() -> Optional[int]:
+    """
+    Return the memory limit of the cgroup, in bytes, or None if unlimited.
+    """
+    limit = read_first_line("/sys/fs/cgroup/memory.max")
+    if limit is None:
+        limit = read_first_line("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if limit is None or limit == "max":
+        return None
+    # cgroup v1 reports "unlimited" as a huge page-aligned number
+    return int(limit) if int(limit) < 1 << 60 else None
+
+
+def available_cpus() -> int:
+    """
+    Number of CPUs the process can actually use: its CPU affinity, capped by the cgroup quota.
+    """
+    cpus = len(os.sched_getaffinity(0))
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.floor(quota))
+    return max(1, cpus)
+
+
+def configure_resources() -> dict:
+    """
+    Derive the serving settings from the CPU quota and memory limit of the container.
+
+    Each setting is only derived when its environment variable is unset, and is then
+    exported so that the rest of the API (and forked workers) read the same value:
+
+    - API_WORKERS: one worker per CPUS_PER_MODEL_CALL CPUs, within the memory limit
+      (WORKER_MEMORY_MB each).
+    - INFERENCE_CONCURRENCY: one model call in flight per CPUS_PER_MODEL_CALL CPUs of a
+      worker.
+    - TORCH_NUM_THREADS: the CPUs of a worker split between its concurrent model calls.
+    - TORCH_INTEROP_THREADS: 1, the model has no parallel branches.
+    - DATALOADER_MAX_WORKERS: 0, DataLoader worker processes would exceed the quota.
+    - DATALOADER_MAX_BATCH_SIZE: 256, lowered to fit FORM_MEMORY_MB per form in the memory
+      limit of a worker.
+
+    The sizing figures are read from their environment variable, defaulting to the constants
+    of this module (see their comment: they are not measurements).
+
+    Returns:
+        dict: The detected limits and the settings in use.
+    """
+    cpus = available_cpus()
+    memory_limit = cgroup_memory_limit()
+    worker_memory = int(os.getenv("WORKER_MEMORY_MB", str(WORKER_MEMORY_MB))) << 20
+    form_memory = int(os.getenv("FORM_MEMORY_MB", str(FORM_MEMORY_MB))) << 20
+    cpus_per_call = int(os.getenv("CPUS_PER_MODEL_CALL", str(CPUS_PER_MODEL_CALL)))
+
+    api_workers = max(1, cpus // cpus_per_call)
+    if memory_limit is not None:
+        api_workers = max(1, min(api_workers, memory_limit // worker_memory))
+    api_workers = int(os.environ.setdefault("API_WORKERS", str(api_workers)))
+
+    worker_cpus = max(1, cpus // api_workers)
+    concurrency = max(1, worker_cpus // cpus_per_call)
+    concurrency = int(os.environ.setdefault("INFERENCE_CONCURRENCY", str(concurrency)))
+
+    batch_size = 256
+    if memory_limit is not None:
+        batch_size = max(16, min(batch_size, memory_limit // api_workers // form_memory))
+
+    settings = {
+        "API_WORKERS": api_workers,
+        "INFERENCE_CONCURRENCY": concurrency,
+        "TORCH_NUM_THREADS": max(1, worker_cpus // concurrency),
+        "TORCH_INTEROP_THREADS": 1,
+        "DATALOADER_MAX_WORKERS": 0,
+        "DATALOADER_MAX_BATCH_SIZE": batch_size,
+    }
+    for name, value in settings.items():
+        settings[name] = int(os.environ.setdefault(name, str(value)))
+
+    logger.info(
+        f"Resources: {cpus} CPUs (quota {cgroup_cpu_quota()}), memory limit {memory_limit}, "
+        f"settings {settings}"
+    )
+    return {"cpus": cpus, "memory_limit": memory_limit, **settings}
+
+
+def set_torch_threads():
+    """
+    Apply TORCH_NUM_THREADS and TORCH_INTEROP_THREADS to the current process.
+    """
+    torch.set_num_threads(int(os.getenv("TORCH_NUM_THREADS", "1")))
+    try:
+        torch.set_num_interop_threads(int(os.getenv("TORCH_INTEROP_THREADS", "1")))
+    except RuntimeError:
+        # The inter-op pool can only be sized before its first use
+        logger.warning("Torch inter-op threads already started, TORCH_INTEROP_THREADS ignored")
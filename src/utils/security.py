@@ -1,6 +1,7 @@
 import os
+import secrets
 
-from fastapi import Request
+from fastapi import HTTPException, Request
 from fastapi.security import HTTPBasic
 
 
@@ -18,3 +19,44 @@ async def get_credentials(request: Request):
         return await HTTPBasic(request)
     else:
         return None
+
+
+async def get_admin_credentials(request: Request):
+    """
+    Check the credentials of the admin endpoints against ADMIN_USERNAME and ADMIN_PASSWORD.
+
+    Admin endpoints are always protected, whatever AUTH_API: they are disabled when no admin
+    credentials are configured.
+
+    Args:
+        request (Request): The incoming request object.
+
+    Returns:
+        HTTPBasicCredentials: The admin credentials.
+
+    Raises:
+        HTTPException: 403 if admin endpoints are disabled, 401 for wrong credentials.
+    """
+    if not os.getenv("ADMIN_USERNAME") or not os.getenv("ADMIN_PASSWORD"):
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+
+    credentials = await HTTPBasic()(request)
+    if not is_admin(credentials.username, credentials.password):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid admin credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return credentials
+
+
+def is_admin(username: str, password: str) -> bool:
+    """
+    Check credentials against ADMIN_USERNAME and ADMIN_PASSWORD (always False when unset).
+    """
+    admin_username, admin_password = os.getenv("ADMIN_USERNAME"), os.getenv("ADMIN_PASSWORD")
+    if not admin_username or not admin_password:
+        return False
+    return secrets.compare_digest(username.encode(), admin_username.encode()) & (
+        secrets.compare_digest(password.encode(), admin_password.encode())
+    )
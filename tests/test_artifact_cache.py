@@ -0,0 +1,64 @@
+import os
+
+from utils.artifact_cache import ArtifactCache
+
+
+def download_model(path: str):
+    os.makedirs(os.path.join(path, "artifacts"))
+    with open(os.path.join(path, "MLmodel"), "w") as f:
+        f.write("flavors: {}\n")
+    with open(os.path.join(path, "artifacts", "weights.bin"), "wb") as f:
+        f.write(b"\x00" * 1024)
+
+
+def test_cached_version_is_reused(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    path = cache.put("model", "1", download_model, source="s3://bucket/1")
+
+    assert cache.get("model", "1", "s3://bucket/1") == path
+    assert cache.get("model", "1", "s3://bucket/other") is None
+    assert cache.get("model", "2") is None
+
+
+def test_intact_files_are_not_hashed_again(tmp_path, monkeypatch):
+    cache = ArtifactCache(str(tmp_path))
+    cache.put("model", "1", download_model)
+    hashed = []
+    monkeypatch.setattr("utils.artifact_cache.file_sha256", hashed.append)
+
+    assert cache.get("model", "1") is not None
+    assert hashed == []
+
+
+def test_altered_files_fail_verification(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    path = cache.put("model", "1", download_model)
+    weights = os.path.join(path, "artifacts", "weights.bin")
+
+    # Same size, new content and modification time: hashed again
+    stat = os.stat(weights)
+    with open(weights, "r+b") as f:
+        f.write(b"\x01")
+    os.utime(weights, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get("model", "1") is None
+
+    # Touched but unchanged: still valid
+    path = cache.put("model", "1", download_model)
+    os.utime(weights, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get("model", "1") == path
+
+    # Truncated or extra files
+    with open(weights, "wb") as f:
+        f.write(b"\x00")
+    assert cache.get("model", "1") is None
+    path = cache.put("model", "1", download_model)
+    open(os.path.join(path, "extra"), "w").close()
+    assert cache.get("model", "1") is None
+
+
+def test_least_recently_used_versions_are_evicted(tmp_path):
+    cache = ArtifactCache(str(tmp_path), keep_versions=2)
+    for version in ("1", "2", "3"):
+        cache.put("model", version, download_model)
+
+    assert sorted(os.listdir(tmp_path / "model")) == ["2", "3"]
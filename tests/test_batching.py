@@ -0,0 +1,107 @@
+import asyncio
+import threading
+
+import pytest
+
+from utils.batching import BatcherOverloadedError, BatcherStoppedError, PredictionBatcher
+
+
+def echo(forms: list, key) -> list:
+    return [(key, form) for form in forms]
+
+
+def test_concurrent_requests_are_merged_and_split_back():
+    calls = []
+
+    def predict(forms, key):
+        calls.append((list(forms), key))
+        return echo(forms, key)
+
+    async def main():
+        batcher = PredictionBatcher(predict, max_batch_size=64, max_wait_ms=50)
+        batcher.start()
+        try:
+            return await asyncio.gather(
+                batcher.submit([1, 2], "a"), batcher.submit([3], "a"), batcher.submit([4], "b")
+            )
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(main())
+
+    assert results == [[("a", 1), ("a", 2)], [("a", 3)], [("b", 4)]]
+    assert sorted(calls) == [([1, 2, 3], "a"), ([4], "b")]
+
+
+def test_model_errors_reach_every_request_of_the_call():
+    def predict(forms, key):
+        raise ValueError("model failure")
+
+    async def main():
+        batcher = PredictionBatcher(predict, max_wait_ms=20)
+        batcher.start()
+        try:
+            return await asyncio.gather(
+                batcher.submit([1], "a"), batcher.submit([2], "a"), return_exceptions=True
+            )
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(main())
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_stop_fails_queued_and_running_requests():
+    release = threading.Event()
+
+    def predict(forms, key):
+        release.wait(5)
+        return echo(forms, key)
+
+    async def main():
+        batcher = PredictionBatcher(predict, max_batch_size=1, max_wait_ms=0)
+        batcher.start()
+        tasks = [asyncio.create_task(batcher.submit([idx], "a")) for idx in range(5)]
+        await asyncio.sleep(0.05)
+        await batcher.stop()
+        release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(main())
+
+    assert len(results) == 5
+    assert all(isinstance(result, BatcherStoppedError) for result in results)
+
+
+def test_empty_requests_skip_the_model():
+    async def main():
+        batcher = PredictionBatcher(pytest.fail)
+        return await batcher.submit([], "a")
+
+    assert asyncio.run(main()) == []
+
+
+def test_requests_beyond_max_pending_are_rejected():
+    release = threading.Event()
+
+    def predict(forms, key):
+        release.wait(5)
+        return echo(forms, key)
+
+    async def main():
+        batcher = PredictionBatcher(predict, max_batch_size=1, max_wait_ms=0, max_pending=2)
+        batcher.start()
+        # One request runs, one waits for the inference slot, two fill the queue
+        tasks = []
+        for idx in range(4):
+            tasks.append(asyncio.create_task(batcher.submit([idx], "a")))
+            await asyncio.sleep(0.02)
+        with pytest.raises(BatcherOverloadedError):
+            await batcher.submit([4], "a")
+        release.set()
+        results = await asyncio.gather(*tasks)
+        await batcher.stop()
+        return results
+
+    assert asyncio.run(main()) == [[("a", idx)] for idx in range(4)]
@@ -0,0 +1,64 @@
+from api.models.forms import SingleForm
+from utils.cache import PredictionCache, form_key
+
+
+def make_form(description: str, **fields) -> SingleForm:
+    return SingleForm(description_activity=description, **fields)
+
+
+def test_form_key_keeps_exact_texts():
+    assert form_key(make_form("VTC")) != form_key(make_form("vtc "))
+    assert form_key(make_form("VTC")) != form_key(make_form("VTC", other_nature_activity="VTC"))
+    assert form_key(make_form("VTC", surface=12.0)) == form_key(make_form("VTC", surface=12.0))
+
+
+def test_key_depends_on_parameters_and_model():
+    form = make_form("boulangerie")
+    key = PredictionCache.key(form, 5, 0.01, "model-1")
+    assert key == PredictionCache.key(make_form("boulangerie"), 5, 0.01, "model-1")
+    assert key != PredictionCache.key(form, 3, 0.01, "model-1")
+    assert key != PredictionCache.key(form, 5, 0.1, "model-1")
+    assert key != PredictionCache.key(form, 5, 0.01, "model-2")
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = PredictionCache(max_size=2, ttl_seconds=0)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("utils.cache.time.monotonic", lambda: now[0])
+    cache = PredictionCache(max_size=10, ttl_seconds=60)
+    cache.set("a", 1)
+
+    now[0] += 59
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+
+
+def test_model_change_clears_the_cache():
+    cache = PredictionCache(max_size=10)
+    cache.ensure_model("model-1")
+    cache.set("a", 1)
+    cache.ensure_model("model-1")
+    assert cache.get("a") == 1
+
+    cache.ensure_model("model-2")
+    assert cache.get("a") is None
+
+
+def test_size_zero_disables_the_cache():
+    cache = PredictionCache(max_size=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from utils.engines import apply_engine, compare_outputs  # noqa: E402
+from utils.inference import PARITY_FORMS, PredictParams, parity_forms, predict_batch  # noqa: E402
+
+CODES = [f"{idx:04d}Z" for idx in range(32)]
+
+
+class ToyClassifier:
+    """
+    Stand-in of a torchTextClassifiers classifier: hashed bag of characters, then a small MLP.
+    """
+
+    def __init__(self):
+        torch.manual_seed(0)
+        self.pytorch_model = torch.nn.Sequential(
+            torch.nn.Linear(64, 128), torch.nn.ReLU(), torch.nn.Linear(128, len(CODES))
+        ).eval()
+
+    def predict(self, texts: list[str], nb_echos_max: int) -> list[dict]:
+        features = torch.zeros(len(texts), 64)
+        for row, text in enumerate(texts):
+            for char in text.lower():
+                features[row, ord(char) % 64] += 1
+        with torch.no_grad():
+            probs = self.pytorch_model(features).softmax(dim=1)
+        top = probs.topk(nb_echos_max, dim=1)
+        return [
+            {
+                **{
+                    str(rank + 1): {"code": CODES[idx], "probabilite": prob, "libelle": ""}
+                    for rank, (prob, idx) in enumerate(zip(values.tolist(), indices.tolist()))
+                },
+                "IC": values[0].item() - values[1].item(),
+            }
+            for values, indices in zip(top.values, top.indices)
+        ]
+
+
+class ToyModel:
+    def __init__(self):
+        self.classifier = ToyClassifier()
+
+    def unwrap_python_model(self):
+        return self
+
+    def predict(self, forms, params=None):
+        return self.classifier.predict([form["description_activity"] for form in forms], 5)
+
+
+def predict_sample(model) -> list[dict]:
+    return model.predict([form for form in PARITY_FORMS])
+
+
+def test_compare_outputs_counts_forms_with_the_same_codes():
+    reference = [{"1": {"code": "A"}, "2": {"code": "B"}, "IC": 0.5}] * 4
+    outputs = reference[:3] + [{"1": {"code": "B"}, "2": {"code": "A"}, "IC": 0.4}]
+
+    parity = compare_outputs(reference, outputs)
+
+    assert parity["codes_agreement"] == 0.75
+    assert parity["max_ic_diff"] == pytest.approx(0.1)
+
+
+def test_quantized_engine_is_used_when_it_passes_the_parity_check():
+    model = ToyModel()
+    eager = model.classifier.pytorch_model
+
+    report = apply_engine(model, "quantized", predict_sample, min_agreement=0.9)
+
+    assert report["engine"] == "quantized"
+    assert model.classifier.pytorch_model is not eager
+    assert any("quantized" in type(m).__module__ for m in model.classifier.pytorch_model.modules())
+
+
+def test_engine_failing_the_parity_check_falls_back_to_eager():
+    model = ToyModel()
+    eager = model.classifier.pytorch_model
+
+    report = apply_engine(model, "quantized", predict_sample, ic_tolerance=-1)
+
+    assert report["engine"] == "eager"
+    assert model.classifier.pytorch_model is eager
+
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError):
+        apply_engine(ToyModel(), "tensorrt", predict_sample)
+
+
+@pytest.mark.skipif(
+    not os.getenv("MLFLOW_MODEL_VERSION"),
+    reason="needs the served model (MLFLOW_MODEL_NAME, MLFLOW_MODEL_VERSION and registry access)",
+)
+def test_quantized_engine_matches_eager_on_the_served_model(monkeypatch):
+    from utils.load_model import load_model
+
+    monkeypatch.setenv("INFERENCE_ENGINE", "eager")
+    model = load_model()
+
+    def predict_model(m) -> list[dict]:
+        return [out.model_dump() for out in predict_batch(m, parity_forms(), PredictParams(5, 0))]
+
+    report = apply_engine(model, "quantized", predict_model)
+
+    assert report["engine"] == "quantized", report
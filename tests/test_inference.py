@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+from api.models.forms import SingleForm
+from utils.cache import PredictionCache
+from utils.inference import PredictParams, predict_forms
+from utils.registry import ModelVersion
+
+
+class Output(SimpleNamespace):
+    def model_dump(self) -> dict:
+        return dict(vars(self))
+
+
+class RecordingBatcher:
+    """
+    Batcher answering each form with its description, and recording the submitted forms.
+    """
+
+    def __init__(self):
+        self.submitted = []
+
+    async def submit(self, forms: list, key) -> list:
+        self.submitted.append(list(forms))
+        return [Output(description=form.description_activity) for form in forms]
+
+
+def make_state() -> SimpleNamespace:
+    return SimpleNamespace(prediction_cache=PredictionCache(), batcher=RecordingBatcher())
+
+
+def descriptions(outputs: list[dict]) -> list[str]:
+    return [out["description"] for out in outputs]
+
+
+MODEL = ModelVersion(version="1", model=None, model_id="model-1")
+PARAMS = PredictParams(5, 0.01)
+
+
+def test_duplicates_are_scored_once_and_outputs_keep_the_input_order():
+    state = make_state()
+    texts = ["boulangerie", "VTC", "boulangerie", "vtc ", "VTC", "boulangerie"]
+    forms = [SingleForm(description_activity=text) for text in texts]
+
+    predictions = asyncio.run(predict_forms(state, forms, PARAMS, MODEL))
+
+    assert descriptions(predictions.outputs) == texts
+    # Texts differing by case or spaces are distinct forms
+    assert [form.description_activity for form in state.batcher.submitted[0]] == [
+        "boulangerie",
+        "VTC",
+        "vtc ",
+    ]
+    assert (predictions.nb_unique, predictions.nb_scored) == (3, 3)
+
+
+def test_cached_forms_are_not_scored_again():
+    state = make_state()
+    first = [SingleForm(description_activity=text) for text in ["boulangerie", "VTC"]]
+    asyncio.run(predict_forms(state, first, PARAMS, MODEL))
+
+    texts = ["VTC", "coiffure", "boulangerie", "coiffure"]
+    forms = [SingleForm(description_activity=text) for text in texts]
+    predictions = asyncio.run(predict_forms(state, forms, PARAMS, MODEL))
+
+    assert descriptions(predictions.outputs) == texts
+    assert [form.description_activity for form in state.batcher.submitted[1]] == ["coiffure"]
+    assert (predictions.nb_unique, predictions.nb_scored) == (3, 1)
+
+
+def test_parameters_and_model_are_part_of_the_dedup_key():
+    state = make_state()
+    forms = [SingleForm(description_activity="boulangerie")]
+    asyncio.run(predict_forms(state, forms, PARAMS, MODEL))
+    asyncio.run(predict_forms(state, forms, PredictParams(3, 0.01), MODEL))
+    other_model = ModelVersion(version="2", model=None, model_id="model-2")
+    asyncio.run(predict_forms(state, forms, PARAMS, other_model))
+
+    assert len(state.batcher.submitted) == 3
@@ -0,0 +1,169 @@
+import asyncio
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import pyarrow.parquet as pq
+
+from utils.batching import BatcherOverloadedError
+from utils.jobs import JobManager, LocalJobStorage
+
+PARAMS = {"nb_echos_max": 1, "prob_min": 0.01}
+# Not affected by the tests patching asyncio.sleep
+real_sleep = asyncio.sleep
+
+
+def make_output(form: dict) -> dict:
+    return {
+        "1": {"code": form["description_activity"], "probabilite": 0.9, "libelle": "libellé"},
+        "IC": 0.5,
+        "MLversion": "model-1",
+    }
+
+
+async def predict(forms: list[dict], params: dict) -> list[dict]:
+    return [make_output(form) for form in forms]
+
+
+def make_forms(nb_forms: int) -> list[dict]:
+    return [{"description_activity": f"{idx:04d}"} for idx in range(nb_forms)]
+
+
+async def wait_status(manager: JobManager, job_id: str, statuses=("done", "failed")) -> dict:
+    for _ in range(200):
+        meta = manager.get(job_id)
+        if meta["status"] in statuses:
+            return meta
+        await real_sleep(0.01)
+    raise TimeoutError(f"Job {job_id} still {meta['status']}")
+
+
+def read_ndjson(storage: LocalJobStorage, job_id: str) -> list[dict]:
+    content = b"".join(storage.read_results(job_id, "ndjson")).decode()
+    return [json.loads(line) for line in content.splitlines()]
+
+
+def test_job_runs_chunk_by_chunk_and_exports_results_in_order(tmp_path):
+    storage = LocalJobStorage(str(tmp_path))
+
+    async def main():
+        manager = JobManager(storage, predict, chunk_size=3)
+        await manager.start()
+        try:
+            meta = await manager.submit(make_forms(10), PARAMS)
+            assert meta["status"] == "pending"
+            assert meta["nb_chunks"] == 4
+            return await wait_status(manager, meta["job_id"])
+        finally:
+            await manager.stop()
+
+    meta = asyncio.run(main())
+
+    assert meta["status"] == "done"
+    assert meta["chunks_done"] == 4
+    codes = [row["1"]["code"] for row in read_ndjson(storage, meta["job_id"])]
+    assert codes == [form["description_activity"] for form in make_forms(10)]
+    table = pq.read_table(io.BytesIO(b"".join(storage.read_results(meta["job_id"], "parquet"))))
+    assert table["code_1"].to_pylist() == codes
+
+
+def test_interrupted_job_resumes_at_its_first_unprocessed_chunk(tmp_path):
+    storage = LocalJobStorage(str(tmp_path))
+    seen = []
+
+    async def predict_seen(forms, params):
+        seen.extend(form["description_activity"] for form in forms)
+        return await predict(forms, params)
+
+    async def main():
+        # A previous process stored the job and its first chunk, then stopped
+        submitter = JobManager(storage, predict, chunk_size=4, runner=False)
+        meta = await submitter.submit(make_forms(10), PARAMS)
+        storage.save_chunk(meta["job_id"], 0, [make_output(f) for f in make_forms(4)])
+        storage.save_meta(meta["job_id"], {**meta, "status": "running", "chunks_done": 1})
+
+        manager = JobManager(storage, predict_seen, chunk_size=4)
+        await manager.start()
+        try:
+            return await wait_status(manager, meta["job_id"])
+        finally:
+            await manager.stop()
+
+    meta = asyncio.run(main())
+
+    assert meta["status"] == "done"
+    assert seen == [form["description_activity"] for form in make_forms(10)[4:]]
+    assert len(read_ndjson(storage, meta["job_id"])) == 10
+
+
+def test_overloaded_predictions_are_retried(tmp_path, monkeypatch):
+    storage = LocalJobStorage(str(tmp_path))
+    attempts = []
+    monkeypatch.setattr("utils.jobs.asyncio.sleep", lambda _: real_sleep(0))
+
+    async def predict_overloaded(forms, params):
+        attempts.append(len(forms))
+        if len(attempts) == 1:
+            raise BatcherOverloadedError("busy")
+        return await predict(forms, params)
+
+    async def main():
+        manager = JobManager(storage, predict_overloaded, chunk_size=10)
+        await manager.start()
+        try:
+            meta = await manager.submit(make_forms(5), PARAMS)
+            return await wait_status(manager, meta["job_id"])
+        finally:
+            await manager.stop()
+
+    assert asyncio.run(main())["status"] == "done"
+    assert attempts == [5, 5]
+
+
+def test_failed_job_is_reported_and_the_runner_keeps_going(tmp_path):
+    storage = LocalJobStorage(str(tmp_path))
+
+    async def predict_failing(forms, params):
+        if forms[0]["description_activity"] == "boom":
+            raise ValueError("model failure")
+        return await predict(forms, params)
+
+    async def main():
+        manager = JobManager(storage, predict_failing, chunk_size=10)
+        await manager.start()
+        try:
+            failed = await manager.submit([{"description_activity": "boom"}], PARAMS)
+            # A job whose metadata disappeared before it ran is skipped
+            manager._enqueue("unknown-job")
+            done = await manager.submit(make_forms(2), PARAMS)
+            return (
+                await wait_status(manager, failed["job_id"]),
+                await wait_status(manager, done["job_id"]),
+            )
+        finally:
+            await manager.stop()
+
+    failed, done = asyncio.run(main())
+
+    assert failed["status"] == "failed"
+    assert failed["error"] == "model failure"
+    assert done["status"] == "done"
+
+
+def test_purge_deletes_finished_jobs_past_retention(tmp_path):
+    storage = LocalJobStorage(str(tmp_path))
+    old = (datetime.now(timezone.utc) - timedelta(days=8)).isoformat()
+    recent = datetime.now(timezone.utc).isoformat()
+    jobs = {
+        "old-done": ("done", old),
+        "old-failed": ("failed", old),
+        "old-running": ("running", old),
+        "recent-done": ("done", recent),
+    }
+    for job_id, (status, updated_at) in jobs.items():
+        storage.save_meta(job_id, {"job_id": job_id, "status": status, "updated_at": updated_at})
+
+    manager = JobManager(storage, predict, retention=7 * 24 * 3600)
+    asyncio.run(manager.purge())
+
+    assert sorted(storage.list_jobs()) == ["old-running", "recent-done"]
@@ -0,0 +1,292 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+# Champs d'un formulaire (SingleForm) envoyés à l'API
+FORM_FIELDS = [
+    "description_activity",
+    "other_nature_activity",
+    "precision_act_sec_agricole",
+    "type_form",
+    "nature",
+    "surface",
+    "cj",
+    "activity_permanence_status",
+]
+# Statuts réessayés : trop de requêtes, modèle en chargement ou API surchargée (503)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Endpoints de prédiction acceptés à la place de l'URL racine de l'API (anciens compris)
+PREDICT_ENDPOINTS = ("/predict-batch", "/predict")
+
+
+def prediction_schema(nb_echos_max: int) -> pa.Schema:
+    # Colonnes des réponses aplaties, nommées comme dans le dashboard
+    return pa.schema(
+        [
+            pa.field(f"Response.{rank}.{name}", type_)
+            for rank in range(1, nb_echos_max + 1)
+            for name, type_ in (
+                ("code", pa.string()),
+                ("probabilite", pa.float64()),
+                ("libelle", pa.string()),
+            )
+        ]
+        + [pa.field("Response.IC", pa.float64()), pa.field("Response.MLversion", pa.string())]
+    )
+
+
+def flatten_responses(responses: list[dict], schema: pa.Schema) -> pa.Table:
+    columns = {name: [None] * len(responses) for name in schema.names}
+    for idx, response in enumerate(responses):
+        for key, value in response.items():
+            if isinstance(value, dict):
+                for name, field_value in value.items():
+                    column = columns.get(f"Response.{key}.{name}")
+                    if column is not None:
+                        column[idx] = field_value
+            elif f"Response.{key}" in columns:
+                columns[f"Response.{key}"][idx] = value
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def to_forms(data: pd.DataFrame, columns: Optional[dict] = None) -> list[dict]:
+    """
+    Convertit les lignes d'un DataFrame en formulaires (valeurs manquantes à None).
+
+    Args:
+        columns (dict): Colonnes envoyées, associées au champ de SingleForm correspondant
+                        (par défaut, les colonnes nommées comme un champ de SingleForm).
+    """
+    columns = columns or {field: field for field in FORM_FIELDS if field in data.columns}
+    forms = data[list(columns)].rename(columns=columns)
+    if "surface" in forms.columns:
+        forms["surface"] = pd.to_numeric(forms["surface"], errors="coerce")
+    forms = forms.astype(object).where(forms.notna(), None)
+    return forms.to_dict(orient="records")
+
+
+def api_base_url(api_path: str) -> str:
+    """
+    Renvoie l'URL racine de l'API à partir de son URL racine ou de l'URL d'un endpoint de
+    prédiction (ex. ".../predict-batch", comme le prenaient les scripts send_batch).
+    """
+    url = api_path.rstrip("/")
+    for endpoint in PREDICT_ENDPOINTS:
+        if url.endswith(endpoint):
+            return url[: -len(endpoint)]
+    return url
+
+
+class PredictionClient:
+    """
+    Client de l'endpoint `/predict/` de l'API pour de gros volumes de formulaires.
+
+    Les DataFrames sont découpés en lots de `chunk_size` formulaires, envoyés en parallèle
+    (`max_workers` requêtes à la fois) sur un pool de connexions HTTP persistantes. Les
+    réponses 429 et 5xx ainsi que les erreurs de connexion sont réessayées avec un délai
+    exponentiel, en respectant l'en-tête Retry-After de l'API. Les résultats sont renvoyés
+    dans l'ordre des données d'entrée.
+
+    Args:
+        base_url (str): URL racine de l'API (ex. "https://codification-ape.lab.sspcloud.fr"),
+                        ou URL de son endpoint de prédiction.
+        auth (tuple[str, str]): Identifiant et mot de passe de l'API.
+        chunk_size (int): Nombre de formulaires par requête.
+        max_workers (int): Nombre de requêtes envoyées en parallèle.
+        max_retries (int): Nombre maximal de nouvelles tentatives par requête.
+        backoff_factor (float): Délai (s) de la première nouvelle tentative, doublé ensuite.
+        timeout (float): Délai maximal (s) d'une requête.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        auth: Optional[tuple[str, str]] = None,
+        chunk_size: int = 1000,
+        max_workers: int = 4,
+        max_retries: int = 5,
+        backoff_factor: float = 0.5,
+        timeout: float = 300,
+    ):
+        self.url = f"{api_base_url(base_url)}/predict/"
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+        retry = Retry(
+            total=max_retries,
+            status_forcelist=RETRY_STATUSES,
+            # Une prédiction peut être rejouée sans effet de bord
+            allowed_methods=None,
+            backoff_factor=backoff_factor,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def predict_forms(self, forms: list[dict], params: dict) -> list[dict]:
+        """
+        Envoie un lot de formulaires et renvoie les réponses de l'API (OutputResponse).
+
+        Raises:
+            requests.HTTPError: Si l'API rejette le lot, ou échoue encore après les nouvelles
+                                tentatives.
+        """
+        response = self.session.post(
+            self.url, params=params, json={"forms": forms}, timeout=self.timeout
+        )
+        if not response.ok:
+            try:
+                detail = response.json()["detail"]
+            except (ValueError, KeyError, TypeError):
+                detail = response.text
+            raise requests.HTTPError(
+                f"{response.status_code} {response.reason}: {detail}", response=response
+            )
+        return response.json()
+
+    def iter_predictions(
+        self,
+        data: pd.DataFrame,
+        nb_echos_max: int = 5,
+        prob_min: float = 0.01,
+        model_version: Optional[str] = None,
+        columns: Optional[dict] = None,
+        progress: bool = True,
+    ) -> Iterator[tuple[pd.DataFrame, pa.Table]]:
+        """
+        Prédit les formulaires d'un DataFrame, dont les colonnes sont converties par `to_forms`.
+
+        Au plus 2 * `max_workers` lots sont en cours à la fois, ce qui borne la mémoire
+        utilisée quelle que soit la taille des données.
+
+        Yields:
+            tuple[pd.DataFrame, pa.Table]: Chaque lot de données d'entrée, dans l'ordre, et les
+                                           réponses aplaties correspondantes (une ligne par
+                                           formulaire, colonnes de `prediction_schema`).
+        """
+        params = {"nb_echos_max": nb_echos_max, "prob_min": prob_min}
+        if model_version is not None:
+            params["model_version"] = model_version
+        schema = prediction_schema(nb_echos_max)
+        chunks = (
+            data.iloc[start : start + self.chunk_size]
+            for start in range(0, len(data), self.chunk_size)
+        )
+
+        with (
+            ThreadPoolExecutor(max_workers=self.max_workers) as executor,
+            tqdm(total=len(data), disable=not progress, unit="forms") as progress_bar,
+        ):
+            pending = deque()
+            for chunk in chunks:
+                future = executor.submit(self.predict_forms, to_forms(chunk, columns), params)
+                pending.append((chunk, future))
+                if len(pending) < 2 * self.max_workers:
+                    continue
+                chunk, future = pending.popleft()
+                yield chunk, flatten_responses(future.result(), schema)
+                progress_bar.update(len(chunk))
+
+            while pending:
+                chunk, future = pending.popleft()
+                yield chunk, flatten_responses(future.result(), schema)
+                progress_bar.update(len(chunk))
+
+    def predict(self, data: pd.DataFrame, **kwargs) -> pd.DataFrame:
+        """
+        Renvoie les réponses aplaties des formulaires d'un DataFrame, dans le même ordre
+        (arguments de `iter_predictions`).
+        """
+        tables = [table for _, table in self.iter_predictions(data, **kwargs)]
+        if not tables:
+            return prediction_schema(kwargs.get("nb_echos_max", 5)).empty_table().to_pandas()
+        return pa.concat_tables(tables).to_pandas()
+
+    def predict_to_parquet(
+        self,
+        data: pd.DataFrame,
+        root_path: str,
+        filesystem=None,
+        partition_col: Optional[str] = None,
+        basename: str = "part-0.parquet",
+        **kwargs,
+    ) -> int:
+        """
+        Prédit les formulaires d'un DataFrame et écrit ses colonnes suivies des réponses
+        aplaties dans des fichiers Parquet, au fil des lots et dans l'ordre des données.
+
+        Args:
+            data (pd.DataFrame): Les données, écrites telles quelles.
+            root_path (str): Dossier des fichiers Parquet.
+            filesystem: Système de fichiers (local par défaut).
+            partition_col (str): Colonne de partitionnement : un fichier par valeur, dans
+                                 `<root_path>/<partition_col>=<valeur>/` (un seul fichier dans
+                                 `root_path` par défaut).
+            basename (str): Nom des fichiers écrits (remplacés s'ils existent).
+            **kwargs: Arguments de `iter_predictions`.
+
+        Returns:
+            int: Le nombre de lignes écrites.
+        """
+        input_schema = pa.Schema.from_pandas(data, preserve_index=False)
+        writers = {}
+        nb_rows = 0
+        try:
+            for chunk, predictions in self.iter_predictions(data, **kwargs):
+                table = pa.Table.from_pandas(chunk, schema=input_schema, preserve_index=False)
+                for field in predictions.schema:
+                    table = table.append_column(field, predictions[field.name])
+
+                # Lignes du lot par dossier de destination
+                if partition_col is None:
+                    parts = {root_path: table}
+                else:
+                    values = table[partition_col]
+                    table = table.drop_columns(partition_col)
+                    parts = {
+                        f"{root_path}/{partition_col}={value}": table.filter(
+                            pc.is_null(values) if value is None else pc.equal(values, value)
+                        )
+                        for value in values.unique().to_pylist()
+                    }
+
+                for directory, part in parts.items():
+                    writer = writers.get(directory)
+                    if writer is None:
+                        if filesystem is None:
+                            os.makedirs(directory, exist_ok=True)
+                        writer = pq.ParquetWriter(
+                            f"{directory}/{basename}", part.schema, filesystem=filesystem
+                        )
+                        writers[directory] = writer
+                    writer.write_table(part)
+                nb_rows += table.num_rows
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        return nb_rows
@@ -1,195 +1,248 @@
+import json
+import logging
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
-import numpy as np
-import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 import s3fs
 from tqdm import tqdm
 
+logger = logging.getLogger(__name__)
+
+FIELDS = [
+    "sourceAppel",
+    "libelleActivite",
+    "natureActivites",
+    "liasseType",
+    "evenementType",
+    "surface",
+    "libelleNettoye",
+    "bilan",
+    "fasttextVersion",
+]
+
+# Expressions régulières compilées une seule fois (et non pour chaque champ de chaque ligne)
+CONTROLLER_PATTERN = re.compile(
+    r"fr.insee.sirene4.(repertoire|services).api.codification.rest.CodificationController:\d{3}"
+)
+FIELD_PATTERNS = {field: re.compile(r"{}=([^,\]]*)".format(re.escape(field))) for field in FIELDS}
+TIMESTAMP_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+)")
+
+# Colonnes extraites de chaque ligne, sous leur nom dans les données préparées
+COLUMNS = {
+    "libelleActivite": "text_description",
+    "liasseType": "type_",
+    "natureActivites": "nature",
+    "surface": "surface",
+    "evenementType": "event",
+    "sourceAppel": "sourceAppel",
+}
+SCHEMA = pa.schema(
+    [pa.field("timestamp", pa.timestamp("ns"))]
+    + [pa.field(name, pa.string()) for name in COLUMNS.values()]
+)
+# Nombre de lignes corrompues affichées par fichier
+MAX_REPORTED_LINES = 5
 
-# Fonction pour extraire les informations des prédictions
-def extract_predictions(predictions_str):
-    regex_pattern = r"\[prediction n° (\d+) : code naf proposé = (\w+) ; proba associée = ([\w.]+(?:E-?\d+)?)\]"
-    matches = re.findall(regex_pattern, predictions_str)
-    return matches
-
-
-# Fonction pour créer un DataFrame à partir de la ligne
-def extract_data_by_line(line):
-    FIELDS = [
-        "sourceAppel",
-        "libelleActivite",
-        "natureActivites",
-        "liasseType",
-        "evenementType",
-        "surface",
-        "libelleNettoye",
-        "bilan",
-        "fasttextVersion",
-    ]
-
-    DATA = {field: re.search(r"{}=([^,\]]*)".format(re.escape(field)), line).group(1).lstrip('"') for field in FIELDS}
-
-    DATA["timestamp"] = datetime.strptime(
-        re.search(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+)", line).group(1),
-        "%Y-%m-%d %H:%M:%S.%f",
-    )
 
-    try:
-        predictions_str = re.search(r"predictions=(\[.*?\],)", line).group(1)
-        predictions = extract_predictions(predictions_str)
+def remove_before_last_double_null(string):
+    # Find the last occurrence of two consecutive '\x00'
+    last_double_null = string.rfind("\x00\x00")
 
-    except AttributeError:
-        predictions = [[np.nan] * 3] * 2
+    # If found, return the substring after it
+    if last_double_null != -1:
+        return string[last_double_null + 2 :]
+    else:
+        # If not found, return the original string
+        return string
 
-    DATA["prediction_1"] = predictions[0][1]
-    DATA["proba_1"] = float(predictions[0][2])
-    DATA["prediction_2"] = predictions[1][1]
-    DATA["proba_2"] = float(predictions[1][2])
 
-    return DATA
+def extract_data_by_line(line: str) -> dict:
+    """
+    Extrait les champs d'une ligne de log de l'application.
 
+    Raises:
+        AttributeError: Si un champ ou l'horodatage est absent (ligne corrompue).
+    """
+    data = {
+        field: pattern.search(line).group(1).lstrip('"')
+        for field, pattern in FIELD_PATTERNS.items()
+    }
+    data["timestamp"] = datetime.strptime(
+        TIMESTAMP_PATTERN.search(line).group(1), "%Y-%m-%d %H:%M:%S.%f"
+    )
+    return data
 
-# Fonction pour extraire les logs d'un fichier
-def extract_log_info(f):
-    """_summary_
 
-    Args:
-        f (_type_): _description_
+def extract_log_info(path: str) -> tuple[pa.Table, dict]:
+    """
+    Lit un fichier de logs ligne à ligne et renvoie ses données sous forme de table Arrow.
 
     Returns:
-        _type_: _description_
+        tuple[pa.Table, dict]: La table et le nombre de lignes lues, extraites et corrompues
+                               (avec quelques exemples de ces dernières).
     """
-    PATTERN = r"fr.insee.sirene4.(repertoire|services).api.codification.rest.CodificationController:\d{3}"
-
-    results = {
-        "timestamp": [],
-        "sourceAppel": [],
-        "libelleActivite": [],
-        "natureActivites": [],
-        "liasseType": [],
-        "evenementType": [],
-        "surface": [],
-        "libelleNettoye": [],
-        "prediction_1": [],
-        "proba_1": [],
-        "prediction_2": [],
-        "proba_2": [],
-        "bilan": [],
-        "fasttextVersion": [],
-    }
+    columns = {name: [] for name in SCHEMA.names}
+    stats = {"lines": 0, "rows": 0, "corrupted": 0, "corrupted_examples": []}
+
+    with open(path, errors="replace") as f:
+        for line in f:
+            stats["lines"] += 1
+            line = remove_before_last_double_null(line)
+            if "CodificationBilan" not in line and (
+                line.isspace() or not line or not CONTROLLER_PATTERN.search(line)
+            ):
+                continue
 
-    lines = f.readlines()
-    for line in lines:
-        line = remove_before_last_double_null(line)
-        idx = line.find("CodificationBilan")
-        is_empty = bool(re.match(r"^\s*$", line))
-        is_valid_line = bool(re.search(PATTERN, line))
-
-        if (is_empty or not is_valid_line) and idx == -1:
-            continue
-
-        if line == lines[-1]:
-            # Some logs are corrupted so we have to deal with that
             try:
                 data = extract_data_by_line(line)
-            except AttributeError:
-                print(f"ERROR for {line}")
-        else:
-            data = extract_data_by_line(line)
-
-        for key in results.keys():
-            results[key].append(data[key])
-    return pd.DataFrame(results)
-
+            except (AttributeError, ValueError):
+                # Certaines lignes sont corrompues (souvent la dernière d'un fichier)
+                stats["corrupted"] += 1
+                if len(stats["corrupted_examples"]) < MAX_REPORTED_LINES:
+                    stats["corrupted_examples"].append(line[:200])
+                continue
+
+            columns["timestamp"].append(data["timestamp"])
+            for field, name in COLUMNS.items():
+                columns[name].append(data[field])
+            stats["rows"] += 1
+
+    return pa.Table.from_pydict(columns, schema=SCHEMA), stats
+
+
+def prepare_logs(table: pa.Table) -> pa.Table:
+    # Suppression des observations sans libellé, ajout de la date pour le partitionnement
+    text_description = pc.utf8_trim_whitespace(table["text_description"])
+    table = table.set_column(
+        table.schema.get_field_index("text_description"), "text_description", text_description
+    )
+    table = table.filter(pc.not_equal(text_description, ""))
+    return table.append_column("date", pc.strftime(table["timestamp"], format="%Y-%m-%d"))
 
-def extract_all_logs(log_path: str):
-    logs_by_file = []
 
-    for file in tqdm(os.listdir(f"{log_path}/")):
-        with open(f"{log_path}/{file}") as f:
-            logs_by_file.append(extract_log_info(f))
+def load_manifest(manifest_path: str) -> dict:
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    return pd.concat(logs_by_file)
 
+def save_manifest(manifest: dict, manifest_path: str):
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
 
-def remove_before_last_double_null(string):
-    # Find the last occurrence of two consecutive '\x00'
-    last_double_null = string.rfind("\x00\x00")
 
-    # If found, return the substring after it
-    if last_double_null != -1:
-        return string[last_double_null + 2 :]
-    else:
-        # If not found, return the original string
-        return string
+def file_signature(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
 
 
-def save_to_s3(table: pa.Table, bucket: str, path: str):
-    fs = s3fs.S3FileSystem(
+def get_filesystem():
+    return s3fs.S3FileSystem(
         client_kwargs={"endpoint_url": "https://" + "minio.lab.sspcloud.fr"},
         key=os.getenv("AWS_ACCESS_KEY_ID"),
         secret=os.getenv("AWS_SECRET_ACCESS_KEY"),
     )
 
+
+def save_file_logs(table: pa.Table, file: str, root_path: str, filesystem):
+    # Le nom des fichiers écrits dépend du fichier de logs : relancer l'extraction d'un
+    # fichier remplace ses données au lieu de les dupliquer
+    basename = re.sub(r"[^\w.-]", "_", file)
     pq.write_to_dataset(
         table,
-        root_path=f"s3://{bucket}/{path}",
+        root_path=root_path,
         partition_cols=["date", "sourceAppel"],
-        basename_template="part-{i}.parquet",
+        basename_template=basename + "-{i}.parquet",
         existing_data_behavior="overwrite_or_ignore",
-        filesystem=fs,
+        filesystem=filesystem,
     )
 
 
-def main(log_file_path: str):
-    # Upload log file from API pod and filter by date
-    logs = extract_all_logs(log_file_path)
-
-    # Add date column for partitionning
-    logs["date"] = logs["timestamp"].dt.strftime("%Y-%m-%d")
-
-    logs = (
-        logs[
-            [
-                "timestamp",
-                "libelleActivite",
-                "liasseType",
-                "natureActivites",
-                "surface",
-                "evenementType",
-                "date",
-                "sourceAppel",
-            ]
-        ]
-        .rename(
-            columns={
-                "libelleActivite": "text_description",
-                "liasseType": "type_",
-                "natureActivites": "nature",
-                "evenementType": "event",
-            }
-        )
-        .reset_index(drop=True)
+def extract_all_logs(
+    log_path: str,
+    root_path: str,
+    manifest_path: str,
+    filesystem=None,
+    max_workers: int = None,
+) -> dict:
+    """
+    Extrait en parallèle les fichiers de logs de `log_path` pas encore traités.
+
+    Les fichiers sont répartis entre des processus ; les données de chaque fichier sont
+    enregistrées dès qu'il est traité, puis le fichier est ajouté au manifeste, ce qui permet
+    de reprendre une extraction interrompue.
+
+    Returns:
+        dict: Les statistiques d'extraction par fichier traité.
+    """
+    manifest = load_manifest(manifest_path)
+    files = sorted(
+        file
+        for file in os.listdir(log_path)
+        if os.path.isfile(os.path.join(log_path, file))
+        and manifest.get(file, {}).get("signature") != file_signature(os.path.join(log_path, file))
     )
+    logger.info(f"{len(files)} log files to extract ({len(manifest)} already extracted)")
+
+    processed = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(extract_log_info, os.path.join(log_path, file)): file for file in files
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            file = futures[future]
+            table, stats = future.result()
+            if stats["corrupted"]:
+                logger.warning(
+                    f"{file}: {stats['corrupted']} corrupted lines, "
+                    f"e.g. {stats['corrupted_examples'][0]!r}"
+                )
+
+            table = prepare_logs(table)
+            if table.num_rows:
+                save_file_logs(table, file, root_path, filesystem)
+
+            manifest[file] = {
+                "signature": file_signature(os.path.join(log_path, file)),
+                **{key: value for key, value in stats.items() if key != "corrupted_examples"},
+            }
+            save_manifest(manifest, manifest_path)
+            processed[file] = stats
 
-    # Removing observations without text description
-    logs["text_description"] = logs["text_description"].apply(lambda x: x.strip())
-    logs["text_description"] = logs["text_description"].replace([""], np.nan)
-    logs = logs.iloc[logs.index[~logs["text_description"].isna()]]
+    return processed
 
-    # Translate pd.DataFrame into pa.Table
-    arrow_table = pa.Table.from_pandas(logs)
 
-    # Save logs in a partionned parquet file in s3
-    save_to_s3(arrow_table, "projet-ape", "log_files/preprocessed")
+def main(log_file_path: str, manifest_path: str):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    processed = extract_all_logs(
+        log_file_path,
+        "projet-ape/log_files/preprocessed",
+        manifest_path,
+        filesystem=get_filesystem(),
+    )
+    logger.info(
+        f"{len(processed)} files extracted: "
+        f"{sum(stats['rows'] for stats in processed.values())} rows, "
+        f"{sum(stats['corrupted'] for stats in processed.values())} corrupted lines"
+    )
 
 
 if __name__ == "__main__":
     log_file_path = str(sys.argv[1])
+    # Manifeste des fichiers déjà extraits, à côté du dossier de logs par défaut
+    manifest_path = (
+        str(sys.argv[2]) if len(sys.argv) > 2 else f"{log_file_path.rstrip('/')}.manifest.json"
+    )
 
-    main(log_file_path)
+    main(log_file_path, manifest_path)
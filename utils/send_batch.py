@@ -1,48 +1,22 @@
 import os
 import sys
-from urllib.parse import urlencode
 
 import pandas as pd
 import pyarrow.dataset as ds
-import requests
 import s3fs
+from api_client import PredictionClient
 
-
-def query_batch_api(
-    username: str,
-    password: str,
-    data: pd.DataFrame,
-    nb_echos_max: int = 5,
-    prob_min: float = 0.01,
-):
-    base_url = "https://codification-ape.lab.sspcloud.fr/predict-batch"
-    params = {"nb_echos_max": nb_echos_max, "prob_min": prob_min}
-    url = f"{base_url}?{urlencode(params)}"
-
-    # Create the request body as a dictionary from the DataFrame
-    request_body = data.to_dict(orient="list")
-    response = requests.post(url, json=request_body, auth=(username, password))
-    if response.status_code == 200:
-        return response.json()
-    elif response.status_code == 400:
-        print(response.json()["detail"])
-    else:
-        print("Error occurred while querying the API.")
-        return None
-
-
-def reclassify_surface(d: str):
-    try:
-        if int(d) < 120:
-            return "1"
-        elif 121 <= int(d) <= 399:
-            return "2"
-        elif 400 <= int(d) <= 2499:
-            return "3"
-        else:
-            return "4"
-    except ValueError:
-        return "null"
+API_URL = "https://codification-ape.lab.sspcloud.fr"
+# La surface est envoyée en m², comme l'attend SingleForm : elle n'est plus regroupée en
+# classes ("1" à "4") et la colonne "event", qui n'est pas un champ de SingleForm, n'est plus
+# envoyée (comme le voulait l'ancien endpoint /predict-batch)
+# Colonnes des logs envoyées à l'API, avec le champ de SingleForm correspondant
+FORM_COLUMNS = {
+    "text_description": "description_activity",
+    "type_": "type_form",
+    "nature": "nature",
+    "surface": "surface",
+}
 
 
 def get_filesystem():
@@ -57,10 +31,7 @@ def get_filesystem():
 def format_query(
     df: pd.DataFrame,
 ):
-    subset = df.copy()
-    subset["surface"] = subset["surface"].apply(reclassify_surface)
-    subset = subset[subset["text_description"] != "NA"]
-    return subset[["text_description", "type_", "nature", "surface", "event"]]
+    return df[df["text_description"] != "NA"]
 
 
 def main(log_file_path: str, date_to_log: str):
@@ -83,7 +54,13 @@ def main(log_file_path: str, date_to_log: str):
     # Harmonize dataset for the query
     data = format_query(data)
 
-    query_batch_api(os.getenv("API_USERNAME"), os.getenv("API_PASSWORD"), data, prob_min=0.0)
+    auth = (os.getenv("API_USERNAME"), os.getenv("API_PASSWORD"))
+    with PredictionClient(API_URL, auth=auth) as client:
+        nb_predictions = sum(
+            len(chunk)
+            for chunk, _ in client.iter_predictions(data, prob_min=0.0, columns=FORM_COLUMNS)
+        )
+    print(f"{nb_predictions} forms predicted")
 
 
 if __name__ == "__main__":
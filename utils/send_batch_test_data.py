@@ -1,49 +1,23 @@
 import os
 import sys
-from urllib.parse import urlencode
 
-import pandas as pd
-import pyarrow as pa
 import pyarrow.dataset as ds
-import pyarrow.parquet as pq
-import requests
 import s3fs
-
-
-def query_batch_api(
-    data: pd.DataFrame,
-    api_path: str,
-    nb_echos_max: int = 5,
-    prob_min: float = 0.01,
-):
-    base_url = api_path
-    params = {"nb_echos_max": nb_echos_max, "prob_min": prob_min}
-    url = f"{base_url}?{urlencode(params)}"
-
-    # Create the request body as a dictionary from the DataFrame
-    request_body = data.to_dict(orient="list")
-    response = requests.post(url, json=request_body)
-    if response.status_code == 200:
-        return response.json()
-    elif response.status_code == 400:
-        print(response.json()["detail"])
-    else:
-        print("Error occurred while querying the API.")
-        return None
-
-
-def reclassify_surface(d: str):
-    try:
-        if int(d) < 120:
-            return "1"
-        elif 121 <= int(d) <= 399:
-            return "2"
-        elif 400 <= int(d) <= 2499:
-            return "3"
-        else:
-            return "4"
-    except ValueError:
-        return "null"
+from api_client import PredictionClient
+
+# La surface est envoyée en m², comme l'attend SingleForm : elle n'est plus regroupée en
+# classes ("1" à "4") et la colonne "event", qui n'est pas un champ de SingleForm, n'est plus
+# envoyée (comme le voulait l'ancien endpoint /predict-batch)
+# Colonnes des données de test envoyées à l'API, avec le champ de SingleForm correspondant
+FORM_COLUMNS = {
+    "text_description": "description_activity",
+    "other_nature_text": "other_nature_activity",
+    "type_": "type_form",
+    "nature": "nature",
+    "surface": "surface",
+    "cj": "cj",
+    "permanence": "activity_permanence_status",
+}
 
 
 def get_filesystem():
@@ -55,57 +29,6 @@ def get_filesystem():
     return fs
 
 
-def format_query(
-    df: pd.DataFrame,
-):
-    subset = df.copy()
-    subset["surface"] = subset["surface"].apply(reclassify_surface)
-    return subset[["text_description", "type_", "nature", "surface", "event"]]
-
-
-def add_prediction_columns(df, results):
-    # List to store dictionaries of values for each row
-    predictions = []
-
-    # Iterate over the results for each row of the DataFrame
-    for result in results:
-        # Dictionary of values for this row
-        row_values = {}
-
-        # Iterate over the response items for this row
-        for i in range(1, 6):
-            if str(i) in result:
-                response = result[str(i)]
-                row_values[f"Response.{i}.code"] = response.get("code", None)
-                row_values[f"Response.{i}.probabilite"] = response.get("probabilite", None)
-                row_values[f"Response.{i}.libelle"] = response.get("libelle", None)
-        row_values["Response.IC"] = result.get("IC", None)
-
-        # Add the dictionary of values to the list of predictions
-        predictions.append(row_values)
-
-    # Create a DataFrame from the list of predictions
-    prediction_df = pd.DataFrame(predictions)
-
-    # Add the prediction columns to the original DataFrame
-    df = pd.concat([df, prediction_df], axis=1)
-
-    return df
-
-
-def save_to_s3(table: pa.Table, bucket: str, path: str):
-    fs = get_filesystem()
-    # To partition data
-    pq.write_to_dataset(
-        table,
-        root_path=f"s3://{bucket}/{path}/",
-        partition_cols=["date"],
-        basename_template="part-{i}.parquet",
-        existing_data_behavior="overwrite_or_ignore",
-        filesystem=fs,
-    )
-
-
 def main(data_file_path: str, dashboard_path: str, api_path: str):  # , date_to_log: str):
     # Define file system
     fs = get_filesystem()
@@ -125,14 +48,21 @@ def main(data_file_path: str, dashboard_path: str, api_path: str):  # , date_to_
         .to_pandas()
     )
 
-    # Harmonize dataset for the query
-    table = format_query(data)
-    results = query_batch_api(table, api_path, prob_min=0.0)
-    table = add_prediction_columns(data, results)
     # Remove 'date=' prefix from the 'date' column to partition again
-    table["date"] = table["date"].str.replace("date=", "")
-    arrow_table = pa.Table.from_pandas(table)
-    save_to_s3(arrow_table, "projet-ape", f"{dashboard_path}")
+    data["date"] = data["date"].str.replace("date=", "")
+
+    # Predictions streamed to the dashboard dataset, partitioned by date
+    auth = (os.getenv("API_USERNAME"), os.getenv("API_PASSWORD"))
+    with PredictionClient(api_path, auth=auth) as client:
+        nb_predictions = client.predict_to_parquet(
+            data,
+            f"projet-ape/{dashboard_path}",
+            filesystem=fs,
+            partition_col="date",
+            prob_min=0.0,
+            columns=FORM_COLUMNS,
+        )
+    print(f"{nb_predictions} forms predicted")
 
 
 if __name__ == "__main__":
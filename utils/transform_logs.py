@@ -1,93 +1,331 @@
 import ast
+import json
 import os
 import sys
+import uuid
 from datetime import datetime, timedelta
+from typing import Optional
 
-import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
 import s3fs
 from dateutil import parser
-from pandas import json_normalize
 
+# Nombre de lignes de logs converties à la fois (mémoire constante)
+CHUNK_SIZE = 100_000
+# Nombre de prédictions conservées par requête, comme dans le dashboard
+NB_ECHOS = 5
 
-def upload_logs(log_file_path: str, day_to_retrieve: str, day_shift: str):
-    # Liste pour stocker les entrées de logs
-    log_entries = []
+# Colonnes attendues par le dashboard : les logs aplatis comme par pandas.json_normalize
+QUERY_FIELDS = {
+    "description_activity": pa.string(),
+    "other_nature_activity": pa.string(),
+    "precision_act_sec_agricole": pa.string(),
+    "type_form": pa.string(),
+    "nature": pa.string(),
+    "surface": pa.float64(),
+    "cj": pa.string(),
+    "activity_permanence_status": pa.string(),
+}
+PREDICTION_FIELDS = {
+    "code": pa.string(),
+    "probabilite": pa.float64(),
+    "libelle": pa.string(),
+}
+BASE_SCHEMA = pa.schema(
+    [pa.field("Timestamp", pa.timestamp("ns"))]
+    + [pa.field(f"Query.{name}", type_) for name, type_ in QUERY_FIELDS.items()]
+    + [
+        pa.field(f"Response.{rank}.{name}", type_)
+        for rank in range(1, NB_ECHOS + 1)
+        for name, type_ in PREDICTION_FIELDS.items()
+    ]
+    + [pa.field("Response.IC", pa.float64()), pa.field("Response.MLversion", pa.string())]
+)
+RESPONSE_TYPES = {
+    field.name: field.type for field in BASE_SCHEMA if field.name.startswith("Response.")
+}
 
-    # Convertir les chaînes de temps en objets datetime
-    start_time = parser.parse(day_to_retrieve) + timedelta(days=int(day_shift))
-    end_time = datetime(start_time.year, start_time.month, start_time.day, 23, 59, 59)
 
-    # Lecture du fichier de logs
-    with open(log_file_path, "r") as file:
-        for line in file:
-            # Extraction de la date et de l'heure de chaque ligne de log
-            log_time_str = line.split(" - ")[0].strip()
-            log_time = parser.parse(log_time_str)
+def parse_timestamp(value: str) -> datetime:
+    # Chemin rapide pour le format fixe des logs : "AAAA-MM-JJ HH:MM:SS,mmm" (ou ".mmm")
+    if len(value) == 23 and value[4] == "-" and value[10] == " " and value[19] in ",.":
+        try:
+            return datetime(
+                int(value[0:4]),
+                int(value[5:7]),
+                int(value[8:10]),
+                int(value[11:13]),
+                int(value[14:16]),
+                int(value[17:19]),
+                int(value[20:23]) * 1000,
+            )
+        except ValueError:
+            pass
+    return parser.parse(value)
 
-            # Vérifier si la ligne est dans l'intervalle de temps spécifié
-            if start_time <= log_time <= end_time:
-                # Ajouter la ligne de log à la liste
-                log_entries.append(line)
 
-    # Créer un DataFrame pandas à partir des entrées de logs
-    columns = ["Timestamp", "LogLevel", "Message"]
-    data = []
+def parse_line(line: str):
+    """
+    Renvoie l'événement de prédiction d'une ligne de log, None si la ligne n'en contient pas.
 
-    for entry in log_entries:
-        timestamp_str, log_level, message = entry.split(" - ", 2)
-        timestamp = parser.parse(timestamp_str) - timedelta(days=int(day_shift))
-        data.append([timestamp, log_level, message])
+    Deux formats sont reconnus : les lignes JSON écrites par l'API (PREDICTION_LOG_SINK=jsonl)
+    et les anciennes lignes texte "<date> - INFO - {'Query': ..., 'Response': ...}".
 
-    log_df = pd.DataFrame(data, columns=columns)
+    Raises:
+        ValueError, SyntaxError: Si la ligne est corrompue.
+    """
+    if line.startswith('{"Timestamp"'):
+        event = json.loads(line)
+        event["Timestamp"] = parse_timestamp(event["Timestamp"])
+        return event
 
-    return log_df
+    timestamp, sep, message = line.partition(" - ")
+    if not sep or not message.startswith("INFO - {'Query'"):
+        return None
+    event = ast.literal_eval(message[len("INFO - ") :].strip())
+    event["Timestamp"] = parse_timestamp(timestamp.strip())
+    return event
 
 
-def process_logs(logs: pd.DataFrame):
-    filtered_logs = logs[(logs["LogLevel"] == "INFO") & (logs["Message"].str.startswith("{'Query'"))]
-    extracted_data = [ast.literal_eval(message) for message in filtered_logs["Message"]]
-    processed_logs = json_normalize(extracted_data)
-    processed_logs.set_index(filtered_logs.index, inplace=True)
-    return processed_logs
+def to_float(value):
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
 
 
-def save_to_s3(table: pa.Table, bucket: str, path: str):
-    fs = s3fs.S3FileSystem(
-        client_kwargs={"endpoint_url": "https://" + "minio.lab.sspcloud.fr"},
-        key=os.getenv("AWS_ACCESS_KEY_ID"),
-        secret=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    )
+def to_type(value, type_: pa.DataType):
+    if type_ == pa.float64():
+        return to_float(value)
+    return None if value is None else str(value)
 
-    pq.write_to_dataset(
-        table,
-        root_path=f"s3://{bucket}/{path}",
-        partition_cols=["date"],
-        basename_template="part-{i}.parquet",
-        existing_data_behavior="overwrite_or_ignore",
-        filesystem=fs,
-    )
 
+def flatten_event(event: dict) -> dict:
+    """
+    Aplatit un événement de prédiction en une ligne du dataset, aux types de BASE_SCHEMA.
 
-def main(log_file_path: str, day_to_retrieve: str, day_shift: str):
-    # Upload log file from API pod and filter by date
-    logs = upload_logs(log_file_path, day_to_retrieve, day_shift)
+    Les colonnes Query inconnues sont conservées (en texte) ; les colonnes Response absentes
+    du schéma, dont les prédictions au-delà de NB_ECHOS, sont ignorées.
+
+    Raises:
+        KeyError, TypeError, AttributeError: Si l'événement n'a pas la forme attendue.
+    """
+    row = {"Timestamp": event["Timestamp"]}
+    for name, value in event["Query"].items():
+        if name == "surface":
+            value = to_float(value)
+        elif value is not None:
+            value = str(value)
+        row[f"Query.{name}"] = value
+    for key, value in event["Response"].items():
+        if isinstance(value, dict):
+            fields = {f"Response.{key}.{name}": field_value for name, field_value in value.items()}
+        else:
+            fields = {f"Response.{key}": value}
+        for column, field_value in fields.items():
+            type_ = RESPONSE_TYPES.get(column)
+            if type_ is not None:
+                row[column] = to_type(field_value, type_)
+    return row
+
+
+class PartitionedWriter:
+    """
+    Écrit des lots de lignes dans un dataset Parquet partitionné par date, un fichier par date
+    et par exécution (un nouveau fichier si de nouvelles colonnes Query apparaissent).
+
+    Les fichiers sont écrits sous un nom caché (préfixe ".", ignoré par les lecteurs Parquet)
+    et ne prennent leur nom définitif qu'avec `commit` : une exécution qui échoue ne laisse
+    aucun fichier visible, et `abort` supprime ses fichiers partiels.
+    """
+
+    def __init__(self, root_path: str, filesystem=None):
+        self.root_path = root_path
+        self.filesystem = filesystem
+        self.run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.writers = {}
+        self.nb_files = 0
+        # Fichiers écrits par l'exécution : (nom caché, nom définitif)
+        self.paths = []
+
+    def write(self, rows_by_date: dict):
+        for date, rows in rows_by_date.items():
+            extra = sorted({name for row in rows for name in row} - set(BASE_SCHEMA.names))
+            schema = pa.schema(list(BASE_SCHEMA) + [pa.field(name, pa.string()) for name in extra])
+            writer = self.writers.get(date)
+            if writer is not None and writer.schema != schema:
+                writer.close()
+                writer = None
+            if writer is None:
+                writer = self.open(date, schema)
+            writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+
+    def open(self, date: str, schema: pa.Schema) -> pq.ParquetWriter:
+        directory = f"{self.root_path}/date={date}"
+        if self.filesystem is None:
+            os.makedirs(directory, exist_ok=True)
+        name = f"part-{self.run_id}-{self.nb_files}.parquet"
+        self.nb_files += 1
+        tmp_path = f"{directory}/.{name}"
+        self.paths.append((tmp_path, f"{directory}/{name}"))
+        self.writers[date] = pq.ParquetWriter(tmp_path, schema, filesystem=self.filesystem)
+        return self.writers[date]
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+    def commit(self):
+        """Ferme les fichiers et leur donne leur nom définitif, qui les rend visibles."""
+        self.close()
+        for tmp_path, path in self.paths:
+            if self.filesystem is None:
+                os.replace(tmp_path, path)
+            else:
+                self.filesystem.mv(tmp_path, path)
+        self.paths = []
+
+    def abort(self):
+        """Supprime les fichiers écrits par l'exécution."""
+        try:
+            self.close()
+        finally:
+            for tmp_path, _ in self.paths:
+                if self.filesystem is None:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                elif self.filesystem.exists(tmp_path):
+                    self.filesystem.rm(tmp_path)
+            self.paths = []
+
+
+def load_checkpoint(checkpoint_path: str, log_file_path: str) -> int:
+    """
+    Renvoie la position (en octets) jusqu'à laquelle le fichier de logs a déjà été converti,
+    0 si le fichier a été remplacé (rotation) ou tronqué depuis.
+    """
+    try:
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    stat = os.stat(log_file_path)
+    if checkpoint.get("inode") != stat.st_ino or checkpoint.get("offset", 0) > stat.st_size:
+        return 0
+    return checkpoint["offset"]
 
-    # Normalize logs into a dataframe
-    data_logs = process_logs(logs)
 
-    # Add timestamp to logs
-    df = pd.merge(logs["Timestamp"], data_logs, how="inner", left_index=True, right_index=True).reset_index(drop=True)
+def save_checkpoint(checkpoint_path: str, log_file_path: str, offset: int):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"inode": os.stat(log_file_path).st_ino, "offset": offset}, f)
+    os.replace(tmp_path, checkpoint_path)
 
-    # Add date column for partitionning
-    df["date"] = df["Timestamp"].dt.strftime("%Y-%m-%d")
 
-    # Translate pd.DataFrame into pa.Table
-    arrow_table = pa.Table.from_pandas(df)
+def convert_logs(
+    log_file_path: str,
+    root_path: str,
+    filesystem=None,
+    checkpoint_path: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    day_shift: int = 0,
+    chunk_size: int = CHUNK_SIZE,
+) -> dict:
+    """
+    Convertit en Parquet les prédictions ajoutées au fichier de logs depuis la dernière exécution.
 
-    # Save logs in a partionned parquet file in s3
-    save_to_s3(arrow_table, "projet-ape", "log_files/dashboard")
+    Le fichier est lu en flux à partir de la position enregistrée dans le checkpoint, par lots
+    de `chunk_size` lignes écrits directement en Arrow. Seules les lignes complètes sont
+    converties ; les fichiers Parquet ne deviennent visibles, et le checkpoint n'avance, qu'une
+    fois toutes les lignes écrites (une exécution qui échoue ne laisse pas de doublons).
+
+    Args:
+        log_file_path (str): Fichier de logs de l'API.
+        root_path (str): Racine du dataset Parquet partitionné par date.
+        filesystem: Système de fichiers du dataset (local par défaut).
+        checkpoint_path (str): Fichier de checkpoint ("<log_file_path>.checkpoint.json" par
+                               défaut).
+        start_time (datetime): Les prédictions antérieures sont ignorées.
+        day_shift (int): Nombre de jours retranchés aux dates des logs.
+
+    Returns:
+        dict: Le nombre de lignes lues, de prédictions converties et de lignes corrompues.
+    """
+    checkpoint_path = checkpoint_path or f"{log_file_path}.checkpoint.json"
+    offset = load_checkpoint(checkpoint_path, log_file_path)
+    stats = {"start_offset": offset, "lines": 0, "predictions": 0, "corrupted": 0}
+    writer = PartitionedWriter(root_path, filesystem)
+
+    def write_chunk(rows_by_date):
+        writer.write(rows_by_date)
+        stats["predictions"] += sum(len(rows) for rows in rows_by_date.values())
+
+    try:
+        with open(log_file_path, "rb") as file:
+            file.seek(offset)
+            rows_by_date = {}
+            nb_rows = 0
+            for raw_line in file:
+                # Ligne en cours d'écriture : elle sera convertie à la prochaine exécution
+                if not raw_line.endswith(b"\n"):
+                    break
+                offset += len(raw_line)
+                stats["lines"] += 1
+
+                try:
+                    event = parse_line(raw_line.decode("utf-8", errors="replace"))
+                    if event is None or (
+                        start_time is not None and event["Timestamp"] < start_time
+                    ):
+                        continue
+                    event["Timestamp"] -= timedelta(days=day_shift)
+                    row = flatten_event(event)
+                except (ValueError, SyntaxError, KeyError, TypeError, AttributeError):
+                    stats["corrupted"] += 1
+                    continue
+                rows_by_date.setdefault(row["Timestamp"].strftime("%Y-%m-%d"), []).append(row)
+                nb_rows += 1
+                if nb_rows >= chunk_size:
+                    write_chunk(rows_by_date)
+                    rows_by_date = {}
+                    nb_rows = 0
+
+            if rows_by_date:
+                write_chunk(rows_by_date)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.commit()
+
+    save_checkpoint(checkpoint_path, log_file_path, offset)
+    stats["end_offset"] = offset
+    return stats
+
+
+def get_filesystem():
+    return s3fs.S3FileSystem(
+        client_kwargs={"endpoint_url": "https://" + "minio.lab.sspcloud.fr"},
+        key=os.getenv("AWS_ACCESS_KEY_ID"),
+        secret=os.getenv("AWS_SECRET_ACCESS_KEY"),
+    )
+
+
+def main(log_file_path: str, day_to_retrieve: str, day_shift: str):
+    # Contrairement à l'ancienne version, qui ne convertissait que le jour demandé, toutes les
+    # prédictions depuis ce jour sont converties : celles qui sont antérieures sont ignorées,
+    # les suivantes sont converties au fil des exécutions grâce au checkpoint
+    start_time = parser.parse(day_to_retrieve) + timedelta(days=int(day_shift))
+
+    stats = convert_logs(
+        log_file_path,
+        "projet-ape/log_files/dashboard",
+        filesystem=get_filesystem(),
+        start_time=start_time,
+        day_shift=int(day_shift),
+    )
+    print(stats)
 
 
 if __name__ == "__main__":